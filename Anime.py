@@ -1,6 +1,14 @@
 class Anime:
+    # Field metadata lives on the class and every instance stores its values in __slots__ instead of a __dict__,
+    # which keeps large repositories small (see benchmarks/anime_memory_benchmark.py)
+    request_fields = 'id,title,main_picture,alternative_titles,start_date,end_date,synopsis,mean,rank,popularity,num_list_users,num_scoring_users,nsfw,created_at,updated_at,media_type,status,genres,my_list_status,num_episodes,start_season,broadcast,source,average_episode_duration,rating,pictures,background,related_anime,related_manga,recommendations,studios,statistics,prequel,sequel'
+    fields = tuple(request_fields.split(',')) + ('mal_url',)
+    __slots__ = fields
+
+    # Fields that describe the anime itself, as opposed to the user's list status and the derived prequel/sequel/mal_url
+    GENERIC_FIELDS = 'title,main_picture,alternative_titles,start_date,end_date,synopsis,mean,rank,popularity,num_list_users,num_scoring_users,nsfw,created_at,updated_at,media_type,status,genres,num_episodes,start_season,broadcast,source,average_episode_duration,rating,pictures,background,related_anime,related_manga,recommendations,studios,statistics'.split(',')
+
     def __init__(self, **kwargs):
-        self.get_fields()
         kwargs['mal_url'] = f'https://myanimelist.net/anime/{kwargs["id"]}/'
 
         for field in self.fields:
@@ -11,10 +19,9 @@ class Anime:
     def get_data_completeness(self):
         pass
 
-    def get_fields(self):
-        self.request_fields = 'id,title,main_picture,alternative_titles,start_date,end_date,synopsis,mean,rank,popularity,num_list_users,num_scoring_users,nsfw,created_at,updated_at,media_type,status,genres,my_list_status,num_episodes,start_season,broadcast,source,average_episode_duration,rating,pictures,background,related_anime,related_manga,recommendations,studios,statistics,prequel,sequel'
-        self.fields = self.request_fields.split(',')
-        self.fields.append('mal_url')
+    @classmethod
+    def get_fields(cls):
+        return cls.fields
 
     def set_prequel(self, prequel):
         self.prequel = prequel
@@ -0,0 +1,110 @@
+import logging
+import threading
+from RelationCrawler import RelationCrawler
+
+
+class RefreshPolicy:
+    """
+    How long the MAL data of an anime stays fresh, depending on its airing status.
+    Airing shows change weekly (episodes, status, new sequels), finished ones hardly ever.
+    """
+    HOUR = 60 * 60
+    DAY = 24 * HOUR
+
+    def __init__(self, ttl_by_status=None, default_ttl=7 * DAY):
+        self.ttl_by_status = ttl_by_status or {
+            'currently_airing': 6 * self.HOUR,
+            'not_yet_aired': 1 * self.DAY,
+            'finished_airing': 30 * self.DAY,
+        }
+        self.default_ttl = default_ttl
+
+    def ttl(self, status):
+        return self.ttl_by_status.get(status, self.default_ttl)
+
+
+class AnimeRefresher:
+    """
+    Background thread that refetches animes whose data has outlived its TTL, a batch at a time.
+
+    Refetches go through the catalog's CatalogClient, which shares the session and rate governor of the Requesters
+    and authorizes its calls with the tokens of the latest user whose tokens still work.
+    IDs it requeued after a failed fetch are fetched again with the next round's crawl.
+    If a refreshed anime gained a new prequel or sequel, the relation crawl is continued from it, by a RelationCrawler
+    of the refresher's own, so its levels are reported by `get_stats` and not in the Requester's build progress.
+
+    :param client: The CatalogClient the animes are fetched with.
+    :param interval: Seconds between two refresh rounds.
+    :param batch_size: Maximum number of animes refetched per round.
+    """
+
+    def __init__(self, client, policy=None, interval=10 * 60, batch_size=20):
+        self.client = client
+        self.anime_repo = client.anime_repo
+        self.policy = policy or RefreshPolicy()
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.num_refreshed = 0
+        self.num_changed = 0
+        self.num_crawled = 0
+        self.last_crawl_levels = []  # level_stats of the latest crawl from changed animes
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.refresh_expired()
+            except Exception as e:
+                logging.error(f'Error refreshing expired animes: {e}', exc_info=True)
+
+    def refresh_expired(self):
+        """
+        Refetches up to `batch_size` expired animes, oldest first.
+
+        :return: The number of animes whose data changed.
+        """
+        if self.client.headers is None:
+            logging.warning('No logged in user with working tokens, skipping the refresh of expired animes')
+            return 0
+        requeued = self.client.take_requeued()
+        expired = self.anime_repo.get_expired_ids(self.policy.ttl)[:self.batch_size]
+        if not expired and not requeued:
+            return 0
+        logging.info(f'Refreshing {len(expired)} expired animes...')
+
+        changed = []
+        infos = self.client.fetch_anime_infos(expired)
+        with self.anime_repo.batch():
+            for info in infos:
+                if info and self.anime_repo.update_anime(info):
+                    changed.append(info['id'])
+
+        self.num_refreshed += len([info for info in infos if info])
+        self.num_changed += len(changed)
+        if changed or requeued:
+            crawler = RelationCrawler(self.client)
+            self.num_crawled += crawler.crawl(start_ids=changed, fetch_ids=requeued)
+            self.last_crawl_levels = crawler.level_stats
+        return len(changed)
+
+    def get_stats(self):
+        return {
+            'refreshed': self.num_refreshed,
+            'changed': self.num_changed,
+            'crawled': self.num_crawled,
+            'relation_levels': list(self.last_crawl_levels),
+            'api_calls': self.client.num_api_calls,
+            'errors': len(self.client.errors),
+            'requeued': len(self.client.requeue),
+        }
@@ -1,14 +1,30 @@
-import os
-import json
+import time
+import weakref
+import threading
 from Anime import Anime
+from AnimeStore import open_default_store
+from LineageIndex import LineageIndex
 
 class AnimeRepository:
-    def __init__(self):
+    """
+    Catalog of the generic MAL data of every anime, deduplicated by id.
+    One repository is shared by all users of the process (see `get_anime_catalog`), what is specific to a user,
+    their list and its list status, lives in a UserAnimeList on top of it.
+    """
+
+    def __init__(self, store=None):
         self.animes = {}
-        self.user_anime_list = None
+        self.store = store or open_default_store()
+        self.fetched_at = {}  # anime id -> unix time it was last fetched from MAL
+        self.lineage_index = LineageIndex(self.animes)
+        self.lock = threading.RLock()
+        self.warm_started = False
+        self.refresher = None
+        self.requesters = []  # Weak references to the attached Requesters, the most recently attached last
 
     def add(self, anime):
         self.animes[anime.id] = anime
+        self.lineage_index.update(anime.id)
 
     def get_all_animes(self):
         return list(self.animes.values())
@@ -19,7 +35,11 @@ class AnimeRepository:
         except:
             return None
         
-    def create_anime(self, info):
+    def create_anime(self, info, persist=True):
+        with self.lock:
+            return self._create_anime(info, persist)
+
+    def _create_anime(self, info, persist):
         if self.get_anime_by_id(info['id']) is None:
             new_anime = Anime(
                 id=info['id'],
@@ -40,7 +60,7 @@ class AnimeRepository:
                 media_type=info.get('media_type', None),
                 status=info.get('status', None),
                 genres=info.get('genres', None),
-                my_list_status=info.get('my_list_status', None),
+                my_list_status=None,  # Per user, kept in UserAnimeList
                 num_episodes=info.get('num_episodes', None),
                 start_season=info.get('start_season', None),
                 broadcast=info.get('broadcast', None),
@@ -58,90 +78,163 @@ class AnimeRepository:
                 sequel=info.get('sequel', None)
             )
             self.add(new_anime)
-            self.save_anime(new_anime)
-
+            if persist:
+                self.save_anime(new_anime)
+                self.fetched_at[new_anime.id] = time.time()
+        return self.get_anime_by_id(info['id'])
+
+    def warm_start(self):
+        """
+        Loads every anime of the store into memory in one pass, without writing them back.
+        Only the first call reads the store, later ones (other users' builds) find the catalog loaded.
+
+        :return: The number of animes in the catalog.
+        """
+        with self.lock:
+            if not self.warm_started:
+                for info in self.store.load_all():
+                    if info and 'id' in info:
+                        self._create_anime(info, persist=False)
+                self.fetched_at.update(self.store.load_fetched_at())
+                self.warm_started = True
+            return len(self.animes)
+
+    def attach_requester(self, requester):
+        """
+        Registers the Requester of a user who just logged in, see `get_requester`.
+        """
+        with self.lock:
+            self.requesters = [ref for ref in self.requesters if ref() is not None and ref() is not requester]
+            self.requesters.append(weakref.ref(requester))
+
+    def get_requester(self):
+        """
+        :return: The most recently attached Requester whose tokens still work, the catalog's refresher authorizes its
+                 MAL calls with it. None if there is none.
+        """
+        with self.lock:
+            for ref in reversed(self.requesters):
+                requester = ref()
+                if requester is not None and requester.tokens_valid:
+                    return requester
+            return None
 
-    def update_anime_list_status(self, all_anime):
-        new_animes = []
-        for anime in all_anime:
-            id = anime.get('node', {}).get('id', None)
-            list_status = anime.get('list_status', {})
-            if id is not None:
-                if self.get_anime_by_id(id) is not None:
-                    self.animes[id].my_list_status = list_status # Update user list status for anime
-                else:
-                    new_animes.append(id) # Append to list, to create entirely new anime object later
-        return new_animes
+    def attach_refresher(self, refresher):
+        """
+        Keeps the first AnimeRefresher offered, one refresher serves the whole catalog.
+
+        :return: The attached refresher.
+        """
+        with self.lock:
+            if self.refresher is None:
+                self.refresher = refresher
+            return self.refresher
+
+    def update_anime(self, info):
+        """
+        Overwrites the generic MAL data of an existing anime with a freshly fetched info dict.
+        Prequel and sequel are derived again from `related_anime`.
+
+        :return: True if MAL reported a change (a different `updated_at`), False if only the fetch time was renewed.
+        """
+        with self.lock:
+            return self._update_anime(info)
+
+    def _update_anime(self, info):
+        anime = self.get_anime_by_id(info['id'])
+        if anime is None:
+            self._create_anime(info, persist=True)
+            return True
+
+        self.fetched_at[anime.id] = time.time()
+        if info.get('updated_at') is not None and info.get('updated_at') == anime.updated_at:
+            self.store.touch([anime.id])
+            return False
+
+        for field in Anime.GENERIC_FIELDS:
+            if field in info:
+                setattr(anime, field, info[field])
+        anime.prequel, anime.sequel = None, None
+        self.set_prequel_sequel(anime)
+        self.save_anime(anime)
+        return True
+
+    def get_expired_ids(self, ttl_for_status, now=None):
+        """
+        Returns the ids of all animes whose data is older than their TTL, oldest first.
+
+        :param ttl_for_status: Callable mapping an anime's airing `status` to a TTL in seconds.
+        """
+        missing = [id for id in list(self.animes) if id not in self.fetched_at]
+        if missing:
+            stored = self.store.load_fetched_at()
+            for id in missing:
+                self.fetched_at[id] = stored.get(id, 0.0)
+        now = now or time.time()
+        expired = []
+        for anime in self.get_all_animes():
+            fetched_at = self.fetched_at.get(anime.id, 0.0)
+            if now - fetched_at >= ttl_for_status(anime.status):
+                expired.append((fetched_at, anime.id))
+        return [id for fetched_at, id in sorted(expired)]
 
 
     def save_anime(self, anime):
-        if not os.path.exists('animes'):
-            os.makedirs('animes')
-        
-        anime_info = anime.to_dict()
-        file_path = os.path.join('animes', f'{anime.id}.json')
-        with open(file_path, 'w') as file:
-            json.dump(anime_info, file, indent=4)
+        self.store.save(anime.to_dict())
 
     def load_anime(self, anime_id):
-        file_path = os.path.join('animes', f'{anime_id}.json')
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as file:
-                return json.load(file)
-        return None
-    
-    def save_user_anime_list(self, all_anime): # actually: refresh user anime list
-        ids = []
-        for info in all_anime:
-            ids.append(info['node']['id'])
-        self.user_anime_list = ids
+        return self.store.load(anime_id)
+
+    def has_stored_anime(self, anime_id):
+        return self.store.exists(anime_id)
+
+    def batch(self):
+        """
+        Context manager, that collects all saves made inside it into a single write to the store.
+        """
+        return self.store.batch()
 
     def get_prequel_sequel(self):
         for anime in self.get_all_animes():
-            for related in anime.related_anime:
-                if related['relation_type'] == 'prequel' and anime.prequel is None:
-                    anime.prequel = related['node']['id']
-                elif related['relation_type'] == 'sequel' and anime.sequel is None:
-                    anime.sequel = related['node']['id']
+            self.set_prequel_sequel(anime)
 
-            if anime.prequel is None:
-                anime.prequel = False
-            if anime.sequel is None:
-                anime.sequel = False
+    def set_prequel_sequel(self, anime):
+        relations = (anime.prequel, anime.sequel)
+        for related in anime.related_anime:
+            if related['relation_type'] == 'prequel' and anime.prequel is None:
+                anime.prequel = related['node']['id']
+            elif related['relation_type'] == 'sequel' and anime.sequel is None:
+                anime.sequel = related['node']['id']
+
+        if anime.prequel is None:
+            anime.prequel = False
+        if anime.sequel is None:
+            anime.sequel = False
+
+        if (anime.prequel, anime.sequel) != relations:
+            self.lineage_index.update(anime.id)
 
     def generate_anime_seasons_liniage(self):
-        
-        def get_complete_lineage(anime_id):
-            if anime_id not in self.animes:
-                return []
-            anime = self.animes[anime_id]
-            lineage = []
-
-            # Traverse to the earliest prequel
-            while anime.prequel:
-                anime = self.animes.get(anime.prequel, None)
-                if not anime:
-                    break
-                lineage.append(anime.id)
-            
-            lineage.reverse()  # Reverse to get chronological order
-
-            # Reset to original anime and traverse through sequels
-            anime = self.animes[anime_id]
-            lineage.append(anime.id)
-            while anime.sequel:
-                anime = self.animes.get(anime.sequel, None)
-                if not anime:
-                    break
-                lineage.append(anime.id)
-
-            return lineage
-
-        anime_lineages = {}
-        for anime in self.get_all_animes():
-            if anime.prequel is False:  # Starting points
-                lineage = get_complete_lineage(anime.id)
-                if len(lineage) > 0:
-                    anime_lineages[anime.id] = lineage
+        """
+        :return: root id -> chronological list of ids, for every first season in the repository.
+        Served from the lineage index, which is kept up to date as animes and relations are added.
+        """
+        return self.lineage_index.get_lineages()
+
+    def get_lineage(self, anime_id):
+        return self.lineage_index.get_lineage(anime_id)
+
+
+_anime_catalog = None
+_anime_catalog_lock = threading.Lock()
+
 
-        return anime_lineages
\ No newline at end of file
+def get_anime_catalog():
+    """
+    Returns the process-wide AnimeRepository shared by every Requester, creating it on first use.
+    """
+    global _anime_catalog
+    with _anime_catalog_lock:
+        if _anime_catalog is None:
+            _anime_catalog = AnimeRepository()
+        return _anime_catalog
@@ -0,0 +1,140 @@
+import time
+import logging
+import sqlite3
+import threading
+import requests
+from RateGovernor import RateGovernor
+
+
+class AniListMapping:
+    """
+    Persistent MAL id -> AniList id table, with the romaji and english titles AniList returns alongside.
+
+    The mapping of an anime never changes, so every id is looked up once and then served from memory.
+    Misses are resolved in batches of up to `batch_size` ids with a single `Page { media(idMal_in: [...]) }` query.
+    MAL ids AniList does not know are remembered too, and asked for again after `miss_ttl` seconds,
+    in case AniList added them in the meantime.
+
+    :param path: SQLite file the table is kept in.
+    :param batch_size: MAL ids per GraphQL request, AniList serves at most 50 media per page.
+    :param miss_ttl: Seconds an unknown MAL id is not asked for again.
+    :param rate_governor: Rate limit for the AniList API, by default 0.5 requests per second with a burst of 5.
+    """
+    URL = 'https://graphql.anilist.co'
+    QUERY = '''
+    query ($ids: [Int], $perPage: Int) {
+      Page(perPage: $perPage) {
+        media(idMal_in: $ids, type: ANIME) {
+          id
+          idMal
+          title {
+            romaji
+            english
+          }
+        }
+      }
+    }
+    '''
+
+    def __init__(self, path='anilist_mapping.db', batch_size=50, miss_ttl=24 * 60 * 60, rate_governor=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.miss_ttl = miss_ttl
+        self.rate_governor = rate_governor or RateGovernor(rate=0.5, burst=5)
+        self.session = requests.Session()
+
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS anilist_mapping (mal_id INTEGER PRIMARY KEY, anilist_id INTEGER, '
+                                'title_romaji TEXT, title_english TEXT, fetched_at REAL NOT NULL)')
+        self.connection.commit()
+        # mal id -> (anilist id or None, romaji, english, fetched_at)
+        self.mapping = {row[0]: row[1:] for row in self.connection.execute('SELECT * FROM anilist_mapping')}
+
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+
+    def get(self, mal_id):
+        """
+        :return: (AniList id, english title), or None if AniList has no anime with this MAL id.
+        """
+        mal_id = int(mal_id)
+        entry = self._cached(mal_id)
+        with self.lock:
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is None:
+            self.resolve([mal_id])
+            entry = self.mapping.get(mal_id)
+        if not entry or entry[0] is None:
+            return None
+        return entry[0], entry[2]
+
+    def prefill(self, mal_ids):
+        """
+        Resolves every MAL id that is not mapped yet, `batch_size` ids per request.
+
+        :return: The number of ids that were looked up.
+        """
+        missing = [mal_id for mal_id in dict.fromkeys(int(mal_id) for mal_id in mal_ids) if self._cached(mal_id) is None]
+        if missing:
+            logging.info(f'Looking up the AniList ids of {len(missing)} animes...')
+            self.resolve(missing)
+        return len(missing)
+
+    def resolve(self, mal_ids):
+        """
+        Looks up `mal_ids` on AniList and stores the results, ids AniList does not return are stored as unknown.
+        Ids of a batch whose request failed stay unmapped.
+        """
+        for start in range(0, len(mal_ids), self.batch_size):
+            batch = mal_ids[start:start + self.batch_size]
+            media = self._query(batch)
+            if media is None:
+                continue
+
+            now = time.time()
+            found = {}
+            for item in media:
+                if item.get('idMal') in batch and item['idMal'] not in found:
+                    found[item['idMal']] = (item['id'], item['title'].get('romaji'), item['title'].get('english'), now)
+            rows = {mal_id: found.get(mal_id, (None, None, None, now)) for mal_id in batch}
+            with self.lock, self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO anilist_mapping VALUES (?, ?, ?, ?, ?)',
+                                            [(mal_id,) + row for mal_id, row in rows.items()])
+                self.mapping.update(rows)
+
+    def _cached(self, mal_id):
+        entry = self.mapping.get(mal_id)
+        if entry is not None and entry[0] is None and time.time() - entry[3] >= self.miss_ttl:
+            return None  # Unknown for too long, ask again
+        return entry
+
+    def _query(self, mal_ids):
+        def send():
+            with self.lock:
+                self.requests += 1
+            return self.session.post(self.URL, json={'query': self.QUERY, 'variables': {'ids': mal_ids, 'perPage': len(mal_ids)}}, timeout=10)
+
+        try:
+            response = self.rate_governor.request(send)
+            data = response.json()
+            if response.status_code != 200 or data.get('errors'):
+                logging.error(f'AniList lookup of {len(mal_ids)} MAL ids failed ({response.status_code}): {data.get("errors")}')
+                return None
+            return data['data']['Page']['media']
+        except Exception as e:
+            logging.error(f'AniList lookup of {len(mal_ids)} MAL ids failed: {e}')
+            return None
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'mapped': len(self.mapping),
+                'hits': self.hits,
+                'misses': self.misses,
+                'requests': self.requests,
+            }
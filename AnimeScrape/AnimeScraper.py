@@ -1,34 +1,64 @@
 import requests
 import logging
-import time
 import json
 from dateutil import parser
 from datetime import datetime, timezone
 import pytz
-from bs4 import BeautifulSoup as bs
-from urllib.parse import urljoin
 from .VideoDownloader import VideoDownloader
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
+from .DriverPool import DriverPool
+from .ScrapeMetrics import ScrapeMetrics
+from .EpisodePageParser import parse_episode_page
+from .AniListMapping import AniListMapping
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+
+
+# Small JS snippets that read only the elements a scrape needs, instead of parsing the whole page_source
+VIDEO_SOURCE_JS = """
+const source = document.querySelector('video[aria-hidden="true"] source[src]:not([src=""])');
+return source ? source.getAttribute('src') : null;
+"""
+
+# arguments: AniList id, airing date selector. a.href is already absolute.
+EPISODE_PAGE_JS = """
+const links = Array.from(document.querySelectorAll('a[href*="watch?id"]'), a => a.href).filter(href => href.includes(arguments[0]));
+const dateDiv = document.querySelector(arguments[1]);
+return {links: Array.from(new Set(links)), date: dateDiv ? dateDiv.textContent.trim() : null};
+"""
+
+AIRING_DATE_SELECTOR = (
+    '.absolute.bottom-0.-translate-y-4.font-karla.whitespace-nowrap.bg-secondary.shadow.px-2.py-1.'
+    'rounded.text-sm.opacity-0.group-hover\\:-translate-y-9.group-hover\\:opacity-100.'
+    'transition-all.duration-200.ease-out.pointer-events-none'
+)
+
 
 class AnimeScraper:
-    def __init__(self):
+    def __init__(self, driver_pool=None, http_fast_path=True, anilist_mapping=None):
+        """
+        :param driver_pool: DriverPool the scrapes take their browser from, by default a pool of 2 headless Chromes.
+        :param http_fast_path: Try to read anime pages over plain HTTP before using a browser.
+        :param anilist_mapping: AniListMapping used to translate MAL IDs, by default the one in anilist_mapping.db.
+        """
         logging.basicConfig(level=logging.INFO)
         logging.getLogger('selenium').setLevel(logging.WARNING)
         logging.getLogger('urllib3').setLevel(logging.WARNING)
 
-    def init_driver(self):
-        self.driver = None
-        options = Options()
-        options.add_argument('--headless')  # Run Chrome in headless mode if you don't want the browser to be visible
-
-        # Initialize the Chrome driver (Selenium manages the driver)
-        self.driver = webdriver.Chrome(options=options)
+        # Starting Chrome dominates an uncached scrape, so browsers are kept warm and reused between scrapes
+        self.driver_pool = driver_pool or DriverPool()
+        self.metrics = ScrapeMetrics()  # Latency histogram per scrape step
+        self.anilist_mapping = anilist_mapping or AniListMapping()
         self.headers = self._load_headers("AnimeScrape/headers.json")
 
+        self.http_fast_path = http_fast_path
+        self.http_session = requests.Session()
+        # headers.json holds the headers for the video CDN, pages are requested like a browser navigation
+        self.http_session.headers.update({
+            'User-Agent': self.headers.get('User-Agent', requests.utils.default_user_agent()),
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Accept-Language': self.headers.get('Accept-Language', 'en-US,en;q=0.9'),
+        })
+
     def _load_headers(self, headers_file):
         """
         Loads HTTP headers from a JSON file.
@@ -53,85 +83,49 @@ class AnimeScraper:
         """
         Uses Selenium to load the page fully, including any JavaScript elements, and extracts the video source URL.
         """
-        self.init_driver()
         ep_url = f"https://shiroko.co/en/anime/watch?id={anime_id}&n={episode}&prv=gogoanime"
         try:
-            logging.info(f"Loading page {ep_url} with Selenium...")
-            self.driver.get(ep_url)
-
-            # Wait for the <video> tag to be present (adjust the condition based on your case)
-            WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.TAG_NAME, 'video'))
-            )
-
-            max_tries, tries = 10, 0
-            while tries < max_tries:
-                html = bs(self.driver.page_source, 'lxml')
-
-                # Find the first <video> tag (adjust the attributes if needed)
-                video = html.find('video', {"aria-hidden": "true"})
-
-                # From the <video> tag, find the nested <source> tag
-                if video:
-                    source_tag = video.find('source')
-                    if source_tag and source_tag.get('src'):
-                        video_src = source_tag['src']
-                        print(f"Video source URL found: {video_src}")
-                        return video_src
-                    else:
-                        print("No source tag or src attribute found inside the video tag.")
-                else:
-                    print("No video tag found.")
-
-                tries += 1
-                time.sleep(0.5)  # Wait a second before retrying
-
+            with self.metrics.time('video_source.total'), self.driver_pool.driver() as driver:
+                logging.info(f"Loading page {ep_url} with Selenium...")
+                with self.metrics.time('video_source.page_load'):
+                    driver.get(ep_url)
+
+                # Waits exactly until the player's <source> got its src, instead of re-parsing the page every 0.5s
+                with self.metrics.time('video_source.wait_source'):
+                    video_src = self._wait_for_script(driver, 15, VIDEO_SOURCE_JS)
+                print(f"Video source URL found: {video_src}")
+                return video_src
+
+        except TimeoutException:
+            logging.error(f"No video source URL appeared on {ep_url}")
             return None
-
         except Exception as e:
             logging.error(f"Failed to extract video source URL using Selenium: {e}")
             return None
 
-        finally:
-            if self.driver:
-                self.driver.quit()
+    def _wait_for_script(self, driver, timeout, script, *args, ready=bool):
+        """
+        Runs a small JS snippet every 100ms until `ready` accepts its result, and returns that result.
+
+        :raises TimeoutException: If no result was ready within `timeout` seconds.
+        """
+        result = None
+
+        def poll(driver):
+            nonlocal result
+            result = driver.execute_script(script, *args)
+            return ready(result)
+
+        WebDriverWait(driver, timeout, poll_frequency=0.1).until(poll)
+        return result
 
     def get_anilist_id_from_mal(self, mal_id):
-        # GraphQL query to search AniList using the MyAnimeList ID
-        query = '''
-        query ($idMal: Int) {
-        Media(idMal: $idMal, type: ANIME) {
-            id
-            title {
-            romaji
-            english
-            }
-        }
-        }
-        '''
-
-        # Set up variables for the GraphQL query
-        variables = {
-            'idMal': mal_id
-        }
-
-        # AniList GraphQL API URL
-        url = 'https://graphql.anilist.co'
-
-        # Make the POST request
-        response = requests.post(url, json={'query': query, 'variables': variables})
-
-        # Parse the response JSON
-        data = response.json()
-
-        # Check if the request was successful and an ID was found
-        if 'data' in data and data['data']['Media']:
-            anilist_id = data['data']['Media']['id']
-            title_romaji = data['data']['Media']['title']['romaji']
-            title_english = data['data']['Media']['title']['english']
-            return anilist_id, title_english
-        else:
-            return None
+        """
+        :return: (AniList ID, english title) of the anime with this MAL ID, or None if AniList does not know it.
+        Served from the persistent AniListMapping, only IDs it has never seen cost a GraphQL request.
+        """
+        with self.metrics.time('anilist_lookup'):
+            return self.anilist_mapping.get(mal_id)
 
     def scrape_episode(self, anime_id, anime_name, episode):
         """
@@ -160,10 +154,8 @@ class AnimeScraper:
         Returns:
             List[str]: A list of episode URLs containing the anilist_id.
         """
-        # Retrieve the AniList ID from MAL ID
-
-        self.init_driver()
         try:
+            # Retrieve the AniList ID from MAL ID
             anilist_id, title_english = self.get_anilist_id_from_mal(mal_anime_id)
             if not anilist_id:
                 print(f"Failed to retrieve AniList ID for MAL ID {mal_anime_id}")
@@ -172,49 +164,17 @@ class AnimeScraper:
             # Construct the Anime URL
             anime_url = f"https://shiroko.co/en/anime/{anilist_id}"
 
+            with self.metrics.time('episodes_available.total'):
+                page = self._get_episode_page(anime_url, anilist_id, 'episodes_available')
 
-            # Fetch the Anime Page
-            self.driver.get(anime_url)
-
-            # Wait for the <video> tag to be present (adjust the condition based on your case)
-            WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.ID, 'Episode List'))
-            )
-            time.sleep(5)
-
-            # Parse the HTML Content
-            soup = bs(self.driver.page_source, 'html.parser')
-
-            # Extract All `a` Tags with `href` Attributes
-            a_tags = soup.find_all('a', href=True)
-
-
-            # Filter Links Containing the `anilist_id`
-            filtered_links = []
-            for tag in a_tags:
-                href = tag['href']
-                # Make the URL absolute if it's relative
-                full_url = urljoin(anime_url, href)
-                if str(anilist_id) in full_url and 'watch?id' in full_url:
-                    filtered_links.append(full_url)
-
-            # Deduplicate the list
-            unique_filtered_links = list(set(filtered_links))
-
+            unique_filtered_links = list(set(page['links']))
             print(f"Found {len(unique_filtered_links)} episode links containing AniList ID {anilist_id}")
-
             return unique_filtered_links
-        
+
         except Exception as e:
             logging.error(f"Failed to retrieve episode data: {e}")
             return {}
 
-        finally:
-            if self.driver:
-                self.driver.quit()
-
-    
-    # TODO: Split into multiple functions
     def get_episode_data(self, mal_anime_id):
         """
         Generic function to retrieve available episodes and next airing date in a single site access.
@@ -225,7 +185,6 @@ class AnimeScraper:
         Returns:
             dict: A dictionary containing 'availableEpisodes' and 'nextAiringDate'.
         """
-        self.init_driver()
         try:
             anilist_id, title_english = self.get_anilist_id_from_mal(mal_anime_id)
             if not anilist_id:
@@ -235,58 +194,15 @@ class AnimeScraper:
             # Construct the Anime URL
             anime_url = f"https://shiroko.co/en/anime/{anilist_id}"
 
-            # Fetch the Anime Page
-            self.driver.get(anime_url)
-
-            css_selector = (
-                '.absolute.bottom-0.-translate-y-4.font-karla.whitespace-nowrap.bg-secondary.shadow.px-2.py-1.'
-                'rounded.text-sm.opacity-0.group-hover\\:-translate-y-9.group-hover\\:opacity-100.'
-                'transition-all.duration-200.ease-out.pointer-events-none'
-            )
-
-            WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located( (By.CSS_SELECTOR, css_selector) )
-            )
-            time.sleep(1)
-
-            # Parse the HTML Content
-            soup = bs(self.driver.page_source, 'html.parser')
-
-            # Extract Available Episodes
-            a_tags = soup.find_all('a', href=True)
-            filtered_links = []
-            for tag in a_tags:
-                href = tag['href']
-                full_url = urljoin(anime_url, href)
-                if str(anilist_id) in full_url and 'watch?id' in full_url:
-                    filtered_links.append(full_url)
-
-            unique_filtered_links = list(set(filtered_links))
+            with self.metrics.time('episode_data.total'):
+                page = self._get_episode_page(anime_url, anilist_id, 'episode_data')
+
+            unique_filtered_links = list(set(page['links']))
             print(f"Found {len(unique_filtered_links)} episode links containing AniList ID {title_english}")
 
-            # Extract Next Airing Date
-            date_div = soup.find('div', class_='absolute bottom-0 -translate-y-4 font-karla whitespace-nowrap bg-secondary shadow px-2 py-1 rounded text-sm opacity-0 group-hover:-translate-y-9 group-hover:opacity-100 transition-all duration-200 ease-out pointer-events-none')
-
-            if date_div:
-                date_str = date_div.get_text(strip=True)
-                print(f"Scraped date string: {date_str}")
-
-                # Parse the date string using dateutil
-                try:
-                    # Example format: "Sat Oct 26, 2024, 4:00 PM GMT+2"
-                    # Replace ', GMT' with ' GMT' to make it parseable
-                    if ', GMT' in date_str:
-                        date_str_clean = date_str.replace(', GMT', ' GMT')
-                    else:
-                        date_str_clean = date_str.strip()
-
-                    # Parse the date string using dateutil
-                    aware_datetime_gmt2 = parser.parse(date_str_clean)
-                    print(f"Next airing episode (GMT+2): {aware_datetime_gmt2}")
-
-                except Exception as e:
-                    logging.error(f"Error parsing date string '{date_str}': {e}")
-                    aware_datetime_gmt2 = None
+            if page['date']:
+                print(f"Scraped date string: {page['date']}")
+                aware_datetime_gmt2 = self._parse_airing_date(page['date'])
             else:
                 print("Next airing date div not found.")
                 aware_datetime_gmt2 = None
@@ -300,9 +216,73 @@ class AnimeScraper:
             logging.error(f"Failed to retrieve episode data: {e}", exc_info=True)
             return {}
 
-        finally:
-            if self.driver:
-                self.driver.quit()
+    def _get_episode_page(self, anime_url, anilist_id, step):
+        """
+        Reads the episode links and airing date of an anime page. Tries a plain HTTP fetch first and only falls back
+        to a browser from the pool if the served HTML holds neither (the page was not rendered server side, or the fetch failed).
+        Which path served the request is counted as `<step>.served_by_http` or `<step>.served_by_browser`.
+
+        :return: {'links': [episode URLs], 'date': airing date string or None}
+        """
+        if self.http_fast_path:
+            with self.metrics.time(f'{step}.http'):
+                page = self._fetch_episode_page_http(anime_url, anilist_id)
+            if page and (page['links'] or page['date']):
+                self.metrics.count(f'{step}.served_by_http')
+                return page
+
+        with self.metrics.time(f'{step}.browser'), self.driver_pool.driver() as driver:
+            with self.metrics.time(f'{step}.page_load'):
+                driver.get(anime_url)
+            with self.metrics.time(f'{step}.wait_episode_page'):
+                page = self._read_episode_page(driver, anilist_id)
+        self.metrics.count(f'{step}.served_by_browser')
+        return page
+
+    def _fetch_episode_page_http(self, anime_url, anilist_id):
+        try:
+            response = self.http_session.get(anime_url, timeout=5)
+            if response.status_code != 200:
+                logging.debug(f"HTTP fetch of {anime_url} returned {response.status_code}, falling back to the browser")
+                return None
+            return parse_episode_page(response.content, anime_url, anilist_id)
+        except Exception as e:
+            logging.debug(f"HTTP fetch of {anime_url} failed ({e}), falling back to the browser")
+            return None
+
+    def _read_episode_page(self, driver, anilist_id):
+        """
+        Waits until the episode list or the next airing date is rendered and gives the other one up to a second to follow.
+        Finished animes have no airing date and unaired ones no episodes, so only one of them may ever show up.
+
+        :return: {'links': [episode URLs], 'date': airing date string or None}
+        """
+        args = (EPISODE_PAGE_JS, str(anilist_id), AIRING_DATE_SELECTOR)
+        page = self._wait_for_script(driver, 10, *args, ready=lambda page: page['links'] or page['date'])
+        if not (page['links'] and page['date']):
+            try:
+                page = self._wait_for_script(driver, 1, *args, ready=lambda page: page['links'] and page['date'])
+            except TimeoutException:
+                page = driver.execute_script(*args)
+        return page
+
+    def _parse_airing_date(self, date_str):
+        # Parse the date string using dateutil
+        try:
+            # Example format: "Sat Oct 26, 2024, 4:00 PM GMT+2"
+            # Replace ', GMT' with ' GMT' to make it parseable
+            if ', GMT' in date_str:
+                date_str_clean = date_str.replace(', GMT', ' GMT')
+            else:
+                date_str_clean = date_str.strip()
+
+            aware_datetime_gmt2 = parser.parse(date_str_clean)
+            print(f"Next airing episode (GMT+2): {aware_datetime_gmt2}")
+            return aware_datetime_gmt2
+
+        except Exception as e:
+            logging.error(f"Error parsing date string '{date_str}': {e}")
+            return None
 
 
 if __name__ == "__main__":
@@ -0,0 +1,288 @@
+import os
+import time
+import logging
+import sqlite3
+import threading
+
+
+class DownloadQueue:
+    """
+    Persistent queue of episode downloads, filled with episode ranges of an anime or with whole lineages,
+    and worked off by `max_downloads` background threads.
+
+    A job is what was asked for (an anime and its episode range, or a lineage), it is expanded into one task per episode
+    when it is added. Jobs and tasks are kept in SQLite, so the queue survives restarts: tasks that were running when the
+    process stopped are queued again and their download resumes from its segment manifest.
+
+    Every task scrapes its episode's link right before downloading it, so the link is fresh, and downloads it with the
+    downloader's SegmentFetcher. All tasks share that fetcher, so its bandwidth cap applies to the whole queue.
+    A failed task is queued again behind the others until it failed `max_attempts` times.
+
+    :param downloader: VideoDownloader the episodes are downloaded with.
+    :param resolve_source: Callable taking a MAL id and an episode number and returning (m3u8 link, None),
+                           or (None, (error message, status code)), like AnimeController.scrape_video_source.
+    :param count_episodes: Callable taking a MAL id and returning its number of episodes, 0 if it is not known.
+    :param anime_repo: The AnimeRepository lineages and titles are looked up in.
+    :param path: SQLite file the queue is kept in.
+    :param output_directory: Episodes are saved as `<output_directory>/<title>/<episode>.ts`.
+    :param max_downloads: Episodes downloaded at the same time.
+    :param max_attempts: Attempts per episode before its task is marked failed.
+    """
+    STATUSES = ('queued', 'running', 'done', 'failed', 'cancelled')
+
+    def __init__(self, downloader, resolve_source, count_episodes, anime_repo, path='download_queue.db',
+                 output_directory='downloaded_animes', max_downloads=2, max_attempts=3):
+        self.downloader = downloader
+        self.resolve_source = resolve_source
+        self.count_episodes = count_episodes
+        self.anime_repo = anime_repo
+        self.output_directory = output_directory
+        self.max_downloads = max_downloads
+        self.max_attempts = max_attempts
+
+        self.lock = threading.RLock()
+        self.wakeup = threading.Condition(self.lock)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS download_jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                    'kind TEXT NOT NULL, mal_id INTEGER NOT NULL, first_episode INTEGER, last_episode INTEGER, '
+                                    'created_at REAL NOT NULL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS download_tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                    'job_id INTEGER NOT NULL, mal_id INTEGER NOT NULL, episode INTEGER NOT NULL, '
+                                    'status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, '
+                                    'bytes INTEGER, output_path TEXT, updated_at REAL NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS download_tasks_status ON download_tasks (status, attempts, id)')
+            # Interrupted by a restart, their downloads resume from the segment manifest
+            self.connection.execute("UPDATE download_tasks SET status = 'queued' WHERE status = 'running'")
+
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.active = set()  # (mal id, episode) of the tasks the worker threads are downloading
+        self.num_downloaded = 0
+        self.bytes_downloaded = 0
+
+    def start(self):
+        if not any(thread.is_alive() for thread in self.threads):
+            self.stop_event.clear()
+            self.threads = [threading.Thread(target=self._run, daemon=True, name=f'download-queue-{i}') for i in range(self.max_downloads)]
+            for thread in self.threads:
+                thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        with self.wakeup:
+            self.wakeup.notify_all()
+
+    def add_episodes(self, mal_anime_id, first_episode=1, last_episode=None):
+        """
+        Queues episodes `first_episode` to `last_episode` of an anime, all of its episodes if `last_episode` is None.
+
+        :return: The job, see `get_job`.
+        :raises ValueError: If the range is empty or the number of episodes is not known.
+        """
+        mal_anime_id, first_episode = int(mal_anime_id), int(first_episode)
+        if last_episode is None:
+            last_episode = self.count_episodes(mal_anime_id)
+            if not last_episode:
+                raise ValueError(f'The number of episodes of {mal_anime_id} is not known, pass the last episode')
+        last_episode = int(last_episode)
+        if first_episode < 1 or last_episode < first_episode:
+            raise ValueError(f'Invalid episode range {first_episode}-{last_episode}')
+
+        episodes = [(mal_anime_id, episode) for episode in range(first_episode, last_episode + 1)]
+        return self._add_job('episodes', mal_anime_id, first_episode, last_episode, episodes)
+
+    def add_lineage(self, lineage_id):
+        """
+        Queues every episode of every season of a lineage.
+
+        :param lineage_id: The first season of the lineage, as keyed by AnimeRepository.generate_anime_seasons_liniage,
+                           or any of its seasons.
+        :return: The job, see `get_job`.
+        :raises ValueError: If the lineage is not known or none of its episode counts is.
+        """
+        lineage_id = int(lineage_id)
+        lineage = self.anime_repo.generate_anime_seasons_liniage().get(lineage_id) or self.anime_repo.get_lineage(lineage_id)
+        if not lineage:
+            raise ValueError(f'No lineage contains {lineage_id}')
+
+        episodes = []
+        for mal_anime_id in lineage:
+            num_episodes = self.count_episodes(mal_anime_id)
+            if not num_episodes:
+                logging.warning(f'The number of episodes of {mal_anime_id} is not known, it is left out of lineage {lineage_id}')
+            episodes.extend((mal_anime_id, episode) for episode in range(1, (num_episodes or 0) + 1))
+        if not episodes:
+            raise ValueError(f'The number of episodes of lineage {lineage_id} is not known')
+        return self._add_job('lineage', lineage[0], None, None, episodes)
+
+    def _add_job(self, kind, mal_anime_id, first_episode, last_episode, episodes):
+        now = time.time()
+        with self.wakeup, self.connection:
+            job_id = self.connection.execute('INSERT INTO download_jobs (kind, mal_id, first_episode, last_episode, created_at) '
+                                             'VALUES (?, ?, ?, ?, ?)', (kind, mal_anime_id, first_episode, last_episode, now)).lastrowid
+            self.connection.executemany("INSERT INTO download_tasks (job_id, mal_id, episode, status, updated_at) VALUES (?, ?, ?, 'queued', ?)",
+                                        [(job_id, mal_id, episode, now) for mal_id, episode in episodes])
+            self.wakeup.notify_all()
+        logging.info(f'Queued {len(episodes)} episodes as download job {job_id}')
+        return self.get_job(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancels the queued and running tasks of a job. Running downloads are finished,
+        a running task that fails stays cancelled instead of being queued again.
+
+        :return: The number of cancelled tasks.
+        """
+        return self._set_status(job_id, 'cancelled', ('queued', 'running'))
+
+    def retry(self, job_id):
+        """
+        Queues the failed and cancelled tasks of a job again.
+
+        :return: The number of queued tasks.
+        """
+        return self._set_status(job_id, 'queued', ('failed', 'cancelled'))
+
+    def _set_status(self, job_id, status, from_statuses):
+        with self.wakeup, self.connection:
+            placeholders = ', '.join('?' * len(from_statuses))
+            changed = self.connection.execute(f'UPDATE download_tasks SET status = ?, attempts = 0, updated_at = ? '
+                                              f'WHERE job_id = ? AND status IN ({placeholders})',
+                                              (status, time.time(), job_id) + tuple(from_statuses)).rowcount
+            self.wakeup.notify_all()
+        return changed
+
+    def get_jobs(self):
+        """
+        :return: Every job with the number of its tasks per status, newest first.
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT * FROM download_jobs ORDER BY id DESC').fetchall()
+            counts = self._count_tasks()
+        return [self._job(row, counts.get(row['id'], {})) for row in rows]
+
+    def get_job(self, job_id, with_tasks=False):
+        """
+        :return: The job as a dict, with the number of its tasks per status and, if `with_tasks`, its tasks. None if unknown.
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT * FROM download_jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = self._job(row, self._count_tasks(job_id).get(job_id, {}))
+            if with_tasks:
+                job['tasks'] = [dict(task) for task in self.connection.execute(
+                    'SELECT mal_id, episode, status, attempts, error, bytes, output_path, updated_at FROM download_tasks '
+                    'WHERE job_id = ? ORDER BY id', (job_id,))]
+        return job
+
+    def _count_tasks(self, job_id=None):
+        query = 'SELECT job_id, status, COUNT(*) FROM download_tasks'
+        parameters = ()
+        if job_id is not None:
+            query += ' WHERE job_id = ?'
+            parameters = (job_id,)
+        counts = {}
+        for row in self.connection.execute(query + ' GROUP BY job_id, status', parameters):
+            counts.setdefault(row[0], {})[row[1]] = row[2]
+        return counts
+
+    def _job(self, row, counts):
+        tasks = {status: counts.get(status, 0) for status in self.STATUSES}
+        if tasks['queued'] or tasks['running']:
+            status = 'running' if tasks['running'] or tasks['done'] or tasks['failed'] else 'queued'
+        elif tasks['failed']:
+            status = 'failed'
+        elif tasks['done']:
+            status = 'done'
+        else:
+            status = 'cancelled'
+        return dict(row, status=status, tasks=tasks)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                task = self._next_task()
+                if task is None:
+                    with self.wakeup:
+                        self.wakeup.wait(timeout=60)
+                    continue
+                try:
+                    self._download(task)
+                except Exception as e:
+                    # Never leave a task 'running', it would block its episode for every later job
+                    logging.error(f'Error downloading {task["mal_id"]} EP.{task["episode"]}: {e}', exc_info=True)
+                    self._finish(task, None, error=str(e))
+            except Exception as e:
+                logging.error(f'Error in the download queue: {e}', exc_info=True)
+                self.stop_event.wait(5)
+
+    def _next_task(self):
+        """
+        Takes the oldest queued task, fresh tasks before retried ones, whose episode is not being downloaded already.
+        """
+        with self.lock, self.connection:
+            rows = self.connection.execute("SELECT * FROM download_tasks WHERE status = 'queued' ORDER BY attempts, id")
+            task = next((row for row in rows if (row['mal_id'], row['episode']) not in self.active), None)
+            if task is not None:
+                self.active.add((task['mal_id'], task['episode']))
+                self.connection.execute("UPDATE download_tasks SET status = 'running', attempts = attempts + 1, updated_at = ? "
+                                        "WHERE id = ?", (time.time(), task['id']))
+        return task
+
+    def _download(self, task):
+        mal_anime_id, episode_number = task['mal_id'], task['episode']
+        m3u8_link, error = self.resolve_source(mal_anime_id, episode_number)
+        if error:
+            # Episodes that are not out yet (404, 417) will not be there on the next attempt either
+            self._finish(task, 'failed' if error[1] < 500 else None, error=error[0])
+            return
+
+        anime = self.anime_repo.get_anime_by_id(mal_anime_id)
+        title = anime.title if anime is not None and anime.title else str(mal_anime_id)
+        output_file = os.path.join(self.output_directory, self.downloader.get_valid_filename(title), str(episode_number))
+        logging.info(f'Downloading {title} EP.{episode_number} (attempt {task["attempts"] + 1})...')
+        message, status = self.downloader.download_video(m3u8_link, output_file)
+        if status != 200:
+            # Could be an expired link, the next attempt scrapes a new one and resumes where this one stopped
+            self.downloader.link_store.set_state(mal_anime_id, episode_number, 'expired', m3u8_link)
+            self._finish(task, None, error=str(message))
+            return
+
+        num_bytes = os.path.getsize(output_file + '.ts')
+        with self.lock:
+            self.num_downloaded += 1
+            self.bytes_downloaded += num_bytes
+        self._finish(task, 'done', num_bytes=num_bytes, output_path=output_file + '.ts')
+
+    def _finish(self, task, status, error=None, num_bytes=None, output_path=None):
+        """
+        :param status: The task's new status, None to queue it again unless it ran out of attempts
+                       or its job was cancelled while it ran.
+        """
+        with self.wakeup, self.connection:
+            if status is None:
+                row = self.connection.execute('SELECT status FROM download_tasks WHERE id = ?', (task['id'],)).fetchone()
+                if row is not None and row['status'] == 'cancelled':
+                    status = 'cancelled'
+                else:
+                    status = 'failed' if task['attempts'] + 1 >= self.max_attempts else 'queued'
+            if error:
+                logging.warning(f'Download of {task["mal_id"]} EP.{task["episode"]} failed ({status}): {error}')
+            self.connection.execute('UPDATE download_tasks SET status = ?, error = ?, bytes = ?, output_path = ?, updated_at = ? WHERE id = ?',
+                                    (status, error, num_bytes, output_path, time.time(), task['id']))
+            self.active.discard((task['mal_id'], task['episode']))
+            self.wakeup.notify_all()
+
+    def get_stats(self):
+        with self.lock:
+            counts = {status: 0 for status in self.STATUSES}
+            for row in self.connection.execute('SELECT status, COUNT(*) FROM download_tasks GROUP BY status'):
+                counts[row[0]] = row[1]
+            return {
+                'tasks': counts,
+                'downloaded': self.num_downloaded,
+                'bytes_downloaded': self.bytes_downloaded,
+            }
@@ -0,0 +1,172 @@
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import TimeoutException
+
+
+def create_headless_chrome():
+    options = Options()
+    options.add_argument('--headless')  # Run Chrome in headless mode if you don't want the browser to be visible
+    # driver.get returns once the DOM is parsed, the scrapes wait for the exact elements they need themselves
+    options.page_load_strategy = 'eager'
+    # Selenium manages the driver
+    return webdriver.Chrome(options=options)
+
+
+class DriverPool:
+    """
+    Pool of warm headless Chrome instances, shared by every scrape of the AnimeScraper.
+
+    Drivers are checked out for one scrape and handed back afterwards, which is safe across Flask threads:
+    a driver is only ever used by the thread that checked it out. Chrome is started lazily, up to `size` instances.
+    A driver is health checked before it is handed out and replaced if it does not answer,
+    it is recycled after `max_pages` scrapes and discarded when a scrape fails with anything but a wait timeout.
+
+    :param size: Maximum number of Chrome instances alive at once.
+    :param max_pages: Number of scrapes (page loads) after which a driver is quit and replaced by a fresh one.
+    :param checkout_timeout: Seconds to wait for a free driver before `checkout` raises TimeoutError.
+    :param driver_factory: Callable returning a new WebDriver.
+    """
+
+    def __init__(self, size=2, max_pages=50, checkout_timeout=60, driver_factory=create_headless_chrome):
+        self.size = size
+        self.max_pages = max_pages
+        self.checkout_timeout = checkout_timeout
+        self.driver_factory = driver_factory
+
+        self.condition = threading.Condition()
+        self.idle = []  # Drivers ready to be checked out, most recently returned last
+        self.pages = {}  # driver -> scrapes served, for every live driver
+        self.starting = 0  # Drivers being started outside the lock, they already count against `size`
+        self.closed = False
+
+        self.drivers_started = 0
+        self.drivers_recycled = 0
+        self.drivers_quit = 0
+        self.checkouts = 0
+        self.seconds_waited = 0.0
+        atexit.register(self.close)
+
+    @contextmanager
+    def driver(self):
+        """
+        Context manager that checks out a driver and returns it to the pool when the block exits.
+        """
+        driver = self.checkout()
+        try:
+            yield driver
+        except TimeoutException:
+            self.checkin(driver)  # The page did not get ready in time, Chrome itself is fine
+            raise
+        except BaseException:
+            self.checkin(driver, broken=True)
+            raise
+        else:
+            self.checkin(driver)
+
+    def checkout(self, timeout=None):
+        """
+        Returns a healthy driver, starting a new one if none is idle and the pool is not full.
+
+        :raises TimeoutError: If no driver became available within `timeout` (default: `checkout_timeout`) seconds.
+        """
+        timeout = self.checkout_timeout if timeout is None else timeout
+        started = time.monotonic()
+        while True:
+            with self.condition:
+                while not self.idle and len(self.pages) + self.starting >= self.size:
+                    remaining = timeout - (time.monotonic() - started)
+                    if self.closed or remaining <= 0 or not self.condition.wait(remaining):
+                        if self.closed:
+                            raise RuntimeError('DriverPool is closed')
+                        raise TimeoutError(f'No browser became available within {timeout}s')
+                if self.closed:
+                    raise RuntimeError('DriverPool is closed')
+                driver = self.idle.pop() if self.idle else None
+                if driver is None:
+                    self.starting += 1
+                self.checkouts += 1
+                self.seconds_waited += time.monotonic() - started
+
+            if driver is None:
+                return self._start_driver()
+            if self._is_healthy(driver):
+                return driver
+            logging.warning('Discarding an unresponsive browser from the pool')
+            self._discard(driver)
+
+    def checkin(self, driver, broken=False):
+        """
+        Hands a checked out driver back. Broken and worn out drivers are quit instead of being reused.
+        """
+        with self.condition:
+            self.pages[driver] = self.pages.get(driver, 0) + 1
+            worn_out = self.pages[driver] >= self.max_pages
+            if not (broken or worn_out or self.closed):
+                self.idle.append(driver)
+                self.condition.notify()
+                return
+            if worn_out and not broken:
+                self.drivers_recycled += 1
+        self._discard(driver)
+
+    def _start_driver(self):
+        try:
+            driver = self.driver_factory()
+        except BaseException:
+            with self.condition:
+                self.starting -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.starting -= 1
+            self.pages[driver] = 0
+            self.drivers_started += 1
+        logging.info('Started a new browser for the scraper pool')
+        return driver
+
+    def _is_healthy(self, driver):
+        try:
+            return driver.execute_script('return 1') == 1
+        except Exception:
+            return False
+
+    def _discard(self, driver):
+        with self.condition:
+            self.pages.pop(driver, None)
+            self.drivers_quit += 1
+            self.condition.notify()
+        try:
+            driver.quit()
+        except Exception as e:
+            logging.debug(f'Error quitting browser: {e}')
+
+    def close(self):
+        """
+        Quits every idle driver. Checked out drivers are quit when they are handed back.
+        """
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.condition.notify_all()
+        for driver in idle:
+            self._discard(driver)
+
+    def get_stats(self):
+        with self.condition:
+            alive = len(self.pages) + self.starting
+            return {
+                'size': self.size,
+                'alive': alive,
+                'idle': len(self.idle),
+                'in_use': alive - len(self.idle),
+                'checkouts': self.checkouts,
+                'drivers_started': self.drivers_started,
+                'drivers_recycled': self.drivers_recycled,
+                'drivers_quit': self.drivers_quit,
+                'seconds_waited': round(self.seconds_waited, 2),
+            }
@@ -0,0 +1,94 @@
+import time
+import logging
+import threading
+from datetime import datetime
+from .SingleFlight import SingleFlight
+
+
+class EpisodeDataCache:
+    """
+    Server side cache of AnimeScraper.get_episode_data results, keyed by MAL id and shared by all sessions.
+
+    How long a result stays fresh depends on whether the anime is airing:
+    - with a next airing date, until that date (the episode list changes then), but at most `airing_ttl`
+      and at least `min_ttl`, so an episode that is late on the site is looked for again every `min_ttl`,
+    - without one (finished, or not announced), for `finished_ttl`,
+    - failed scrapes (an empty result) for `failure_ttl`.
+
+    Concurrent misses for the same anime are coalesced: one caller scrapes, the others wait for its result.
+    """
+    MINUTE = 60
+    HOUR = 60 * MINUTE
+
+    def __init__(self, airing_ttl=6 * HOUR, finished_ttl=24 * HOUR, min_ttl=15 * MINUTE, failure_ttl=MINUTE):
+        self.airing_ttl = airing_ttl
+        self.finished_ttl = finished_ttl
+        self.min_ttl = min_ttl
+        self.failure_ttl = failure_ttl
+
+        self.lock = threading.Lock()
+        self.entries = {}  # mal id -> (expires_at, episode data)
+        self.single_flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.scrapes = 0
+
+    def get(self, mal_anime_id, scrape):
+        """
+        :param scrape: Callable taking the MAL id and returning fresh episode data, called on a miss.
+        :return: The episode data, from the cache if it is still fresh. Callers must not modify it, it is shared.
+        """
+        with self.lock:
+            entry = self.entries.get(mal_anime_id)
+            if entry is not None and entry[0] > time.time():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        return self.single_flight.do(mal_anime_id, lambda: self._scrape(mal_anime_id, scrape))
+
+    def _scrape(self, mal_anime_id, scrape):
+        with self.lock:
+            # Another caller may have stored a result between our miss and this call
+            entry = self.entries.get(mal_anime_id)
+            if entry is not None and entry[0] > time.time():
+                return entry[1]
+            self.scrapes += 1
+        episode_data = scrape(mal_anime_id)
+        now = time.time()
+        with self.lock:
+            self.entries[mal_anime_id] = (now + self.ttl(episode_data, now), episode_data)
+        return episode_data
+
+    def ttl(self, episode_data, now=None):
+        """
+        :return: Seconds `episode_data` stays fresh.
+        """
+        if not episode_data:
+            return self.failure_ttl
+        next_airing_date = episode_data.get('nextAiringDate')
+        if not next_airing_date:
+            return self.finished_ttl
+        try:
+            until_airing = datetime.fromisoformat(next_airing_date).timestamp() - (now or time.time())
+        except ValueError:
+            logging.warning(f"Unexpected next airing date '{next_airing_date}', caching it as airing")
+            return self.airing_ttl
+        return max(self.min_ttl, min(self.airing_ttl, until_airing))
+
+    def invalidate(self, mal_anime_id):
+        with self.lock:
+            self.entries.pop(mal_anime_id, None)
+
+    def get_stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            stats = {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'scrapes': self.scrapes,
+                'hit_ratio': round(self.hits / requests, 3) if requests else None,
+            }
+        stats.update(self.single_flight.get_stats())
+        return stats
@@ -0,0 +1,161 @@
+import os
+import time
+import json
+import logging
+import threading
+
+
+class EpisodeLinkStore:
+    """
+    The scraped m3u8 links, one per (MAL anime id, episode).
+
+    All links are held in a dict for O(1) lookups. Every save appends one JSON line to `path`,
+    so a write never rewrites (or corrupts) the links saved before it; later lines win when the file is read.
+    The file is compacted once it holds more than twice as many lines as there are links.
+    Writers are serialized by a lock, get one store per file with `get_link_store`.
+
+    Besides the link, a record holds when it was scraped (`fetched_at`), when it was last probed (`checked_at`)
+    and its `state`: 'valid', or 'expired' once a probe found the CDN no longer serves it.
+    Expired links are not handed out by `get_link`, so callers scrape a fresh one.
+
+    :param path: The append-only JSON lines file.
+    :param legacy_path: The old episode_links.json, imported once if `path` does not exist yet.
+    """
+
+    def __init__(self, path='m3u8/episode_links.jsonl', legacy_path='m3u8/episode_links.json'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.links = {}  # (mal anime id, episode) -> record
+        self.last_used = {}  # (mal anime id, episode) -> unix time get_link last handed the link out, not persisted
+        self.lines = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(path):
+            self._load()
+        elif legacy_path and os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+
+    def get(self, mal_anime_id, episode_number):
+        """
+        :return: The stored record ({'mal_anime_id', 'episode', 'link', 'fetched_at', 'checked_at', 'state'}) or None.
+                 Links imported from the old JSON file only have the first three.
+        """
+        return self.links.get((int(mal_anime_id), int(episode_number)))
+
+    def get_link(self, mal_anime_id, episode_number):
+        """
+        :return: The link of an episode, None if none was saved or the saved one expired.
+        """
+        record = self.get(mal_anime_id, episode_number)
+        if not record or record.get('state') == 'expired':
+            return None
+        self.last_used[(record['mal_anime_id'], record['episode'])] = time.time()
+        return record['link']
+
+    def save(self, mal_anime_id, episode_number, link, **fields):
+        """
+        Stores the link of an episode, replacing the one saved before. Extra fields are stored with it.
+        """
+        record = dict(fields, mal_anime_id=int(mal_anime_id), episode=int(episode_number), link=link)
+        with self.lock:
+            self._append(record)
+        return record
+
+    def set_state(self, mal_anime_id, episode_number, state, link=None):
+        """
+        Records the outcome of a probe of the episode's link.
+
+        :param link: The link that was probed. If another one was saved meanwhile, the state is not changed,
+                     so a freshly scraped link is not marked with the outcome of the old one.
+        :return: The updated record, None if there was nothing to update.
+        """
+        with self.lock:
+            record = self.links.get((int(mal_anime_id), int(episode_number)))
+            if not record or (link is not None and record['link'] != link):
+                return None
+            record = dict(record, state=state, checked_at=time.time())
+            self._append(record)
+        return record
+
+    def records(self):
+        with self.lock:
+            return list(self.links.values())
+
+    def _load(self):
+        unreadable = False
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    self.links[(record['mal_anime_id'], record['episode'])] = record
+                except (ValueError, KeyError):
+                    # An interrupted append leaves a partial last line behind
+                    logging.warning(f'Skipping unreadable line {number} of {self.path}')
+                    unreadable = True
+                self.lines += 1
+        if unreadable:
+            # Rewrite the file without it, or the next append would be glued to the partial line
+            with self.lock:
+                self._compact()
+
+    def _import_legacy(self, legacy_path):
+        """
+        Reads the old {anime id: [{episode: link}, ...]} file.
+        """
+        try:
+            with open(legacy_path, 'r') as file:
+                data = json.load(file)
+        except ValueError as e:
+            logging.error(f'Could not import {legacy_path}: {e}')
+            data = {}
+        for mal_anime_id, episodes in data.items():
+            for episode in episodes:
+                for episode_number, link in episode.items():
+                    record = {'mal_anime_id': int(mal_anime_id), 'episode': int(episode_number), 'link': link}
+                    self.links[(record['mal_anime_id'], record['episode'])] = record
+        with self.lock:
+            self._compact()
+        logging.info(f'Imported {len(self.links)} episode links from {legacy_path} into {self.path}')
+
+    def _append(self, record):
+        # Called with the lock held
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(record) + '\n')
+        self.links[(record['mal_anime_id'], record['episode'])] = record
+        self.lines += 1
+        if self.lines > 2 * len(self.links) + 100:
+            self._compact()
+
+    def _compact(self):
+        # Writes the current links to a temporary file and swaps it in, a crash leaves either the old or the new file
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            for record in self.links.values():
+                file.write(json.dumps(record) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.path)
+        self.lines = len(self.links)
+
+    def get_stats(self):
+        with self.lock:
+            return {'links': len(self.links), 'lines': self.lines}
+
+
+_link_stores = {}
+_link_stores_lock = threading.Lock()
+
+
+def get_link_store(path='m3u8/episode_links.jsonl', legacy_path='m3u8/episode_links.json'):
+    """
+    Returns the process-wide EpisodeLinkStore for `path`, so all writers of a file share its lock and index.
+    """
+    key = os.path.abspath(path)
+    with _link_stores_lock:
+        if key not in _link_stores:
+            _link_stores[key] = EpisodeLinkStore(path, legacy_path)
+        return _link_stores[key]
@@ -0,0 +1,31 @@
+from urllib.parse import urljoin
+from lxml import html as lxml_html
+
+
+# The class attribute of the element that holds the next airing date on an anime page
+AIRING_DATE_CLASS = 'absolute bottom-0 -translate-y-4 font-karla whitespace-nowrap bg-secondary shadow px-2 py-1 rounded text-sm opacity-0 group-hover:-translate-y-9 group-hover:opacity-100 transition-all duration-200 ease-out pointer-events-none'
+
+
+def parse_episode_page(page_html, anime_url, anilist_id):
+    """
+    Reads the episode links and the next airing date from the HTML of a shiroko.co anime page.
+
+    :param page_html: The page's HTML, as served over HTTP or taken from a browser.
+    :param anime_url: The URL the page was loaded from, relative links are resolved against it.
+    :param anilist_id: The AniList ID of the anime, only links containing it are episode links of this anime.
+    :return: {'links': [unique absolute episode URLs], 'date': airing date string or None}, the format of
+             AnimeScraper._read_episode_page.
+    """
+    document = lxml_html.fromstring(page_html)
+
+    links, seen = [], set()
+    for href in document.xpath('//a[contains(@href, "watch?id")]/@href'):
+        full_url = urljoin(anime_url, href)
+        if str(anilist_id) in full_url and full_url not in seen:
+            seen.add(full_url)
+            links.append(full_url)
+
+    date_divs = document.xpath('//div[@class=$date_class]', date_class=AIRING_DATE_CLASS)
+    date = date_divs[0].text_content().strip() if date_divs else None
+
+    return {'links': links, 'date': date or None}
@@ -0,0 +1,166 @@
+import re
+import time
+import logging
+import threading
+import requests
+
+LINK_TIMESTAMP = re.compile(r'\.(\d{10})\.m3u8')  # e.g. ep.3.1728834259.m3u8
+
+
+def link_timestamp(link):
+    """
+    :return: The unix time a scraped m3u8 link was signed at, taken from its file name, or None.
+    """
+    match = LINK_TIMESTAMP.search(link or '')
+    return int(match.group(1)) if match else None
+
+
+class LinkRevalidator:
+    """
+    Background thread that keeps the scraped m3u8 links of the episodes being watched playable.
+
+    Only links handed out or scraped within `active_window` are looked after, the others are left alone until they are
+    requested again. Each round, a batch of them is
+    - re-scraped if it is older than `refresh_after`, before the CDN stops serving it,
+    - otherwise probed with a GET of its master playlist (a few hundred bytes) if it was not checked for `probe_interval`.
+      A link the CDN refuses is marked expired in the link store and re-scraped right away.
+
+    A link whose re-scrape failed stays expired, the link store does not hand it out, so playback scrapes a new one.
+    It is not re-scraped again before `retry_backoff` seconds, doubled on every further failure up to `max_retry_backoff`,
+    so links that keep failing neither cost a browser page load every round nor crowd the healthy ones out of the batch.
+
+    :param link_store: The EpisodeLinkStore holding the links.
+    :param rescrape: Callable taking a MAL id and an episode number, scraping and saving a new link and returning it or None.
+    :param session: requests.Session for the probes, with the headers the CDN expects.
+    :param interval: Seconds between two rounds.
+    :param batch_size: Maximum number of probes and re-scrapes per round.
+    """
+    MINUTE = 60
+    HOUR = 60 * MINUTE
+
+    def __init__(self, link_store, rescrape, session=None, interval=5 * MINUTE, batch_size=10,
+                 probe_interval=30 * MINUTE, refresh_after=6 * HOUR, active_window=48 * HOUR, probe_timeout=10,
+                 retry_backoff=10 * MINUTE, max_retry_backoff=12 * HOUR):
+        self.link_store = link_store
+        self.rescrape = rescrape
+        self.session = session or requests.Session()
+        self.interval = interval
+        self.batch_size = batch_size
+        self.probe_interval = probe_interval
+        self.refresh_after = refresh_after
+        self.active_window = active_window
+        self.probe_timeout = probe_timeout
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.num_probed = 0
+        self.num_expired = 0
+        self.num_rescraped = 0
+        self.num_rescrapes_failed = 0
+        self.failed_rescrapes = {}  # (mal anime id, episode) -> (consecutive failed re-scrapes, unix time of the next attempt)
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.revalidate()
+            except Exception as e:
+                logging.error(f'Error revalidating episode links: {e}', exc_info=True)
+
+    def revalidate(self, now=None):
+        """
+        Probes or re-scrapes up to `batch_size` active links, the oldest first.
+
+        :return: The number of links that were re-scraped.
+        """
+        now = now or time.time()
+        due = []
+        for record in self.link_store.records():
+            key = (record['mal_anime_id'], record['episode'])
+            fetched_at = self.fetched_at(record)
+            if max(self.link_store.last_used.get(key, 0), fetched_at) < now - self.active_window:
+                continue
+            if record.get('state') == 'expired' or now - fetched_at >= self.refresh_after:
+                _, next_attempt_at = self.failed_rescrapes.get(key, (0, 0))
+                if now >= next_attempt_at:
+                    due.append((fetched_at, key, True))
+                continue
+            self.failed_rescrapes.pop(key, None)  # A new link was saved meanwhile
+            if now - record.get('checked_at', fetched_at) >= self.probe_interval:
+                due.append((fetched_at, key, False))
+        due.sort()
+
+        num_rescraped = 0
+        for _, (mal_anime_id, episode_number), rescrape in due[:self.batch_size]:
+            if self.stop_event.is_set():
+                break
+            if not rescrape:
+                record = self.link_store.get(mal_anime_id, episode_number)
+                valid = self.probe(record['link'])
+                if valid is None:
+                    continue  # Could not tell, probe again next round
+                if not self.link_store.set_state(mal_anime_id, episode_number, 'valid' if valid else 'expired', record['link']):
+                    continue  # A new link was saved while this one was probed
+                if valid:
+                    continue
+                self.num_expired += 1
+                logging.info(f'The link of {mal_anime_id} EP.{episode_number} expired, scraping a new one...')
+            if self._rescrape(mal_anime_id, episode_number):
+                num_rescraped += 1
+        return num_rescraped
+
+    def probe(self, link):
+        """
+        :return: True if the CDN still serves the master playlist at `link`, False if it refuses it,
+                 None if that could not be told (network error, server error).
+        """
+        self.num_probed += 1
+        try:
+            response = self.session.get(link, timeout=self.probe_timeout)
+        except requests.RequestException as e:
+            logging.warning(f'Could not probe {link}: {e}')
+            return None
+        if response.status_code >= 500:
+            return None
+        return response.status_code == 200 and response.text.lstrip().startswith('#EXTM3U')
+
+    def fetched_at(self, record):
+        # Links saved before fetched_at was stored carry their signing time in the file name
+        return record.get('fetched_at') or link_timestamp(record['link']) or 0
+
+    def _rescrape(self, mal_anime_id, episode_number):
+        try:
+            link = self.rescrape(mal_anime_id, episode_number)
+        except Exception as e:
+            logging.error(f'Error re-scraping the link of {mal_anime_id} EP.{episode_number}: {e}', exc_info=True)
+            link = None
+        key = (int(mal_anime_id), int(episode_number))
+        if link:
+            self.num_rescraped += 1
+            self.failed_rescrapes.pop(key, None)
+        else:
+            self.num_rescrapes_failed += 1
+            failures = self.failed_rescrapes.get(key, (0, 0))[0] + 1
+            delay = min(self.max_retry_backoff, self.retry_backoff * 2 ** (failures - 1))
+            self.failed_rescrapes[key] = (failures, time.time() + delay)
+            logging.info(f'Re-scraping {mal_anime_id} EP.{episode_number} failed {failures} times, next attempt in {delay / 60:.0f} min')
+        return bool(link)
+
+    def get_stats(self):
+        return {
+            'probed': self.num_probed,
+            'expired': self.num_expired,
+            'rescraped': self.num_rescraped,
+            'rescrapes_failed': self.num_rescrapes_failed,
+            'backing_off': len(self.failed_rescrapes),
+        }
@@ -0,0 +1,81 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+class LatencyHistogram:
+    """
+    Cumulative latency histogram: how many observations took at most each bucket's upper bound in seconds.
+    """
+    BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last one counts everything above the largest bound
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            buckets[f'le_{bound}'] = cumulative
+        return {
+            'count': self.count,
+            'avg_seconds': round(self.total / self.count, 3) if self.count else None,
+            'max_seconds': round(self.max, 3),
+            'buckets': buckets,
+        }
+
+
+class ScrapeMetrics:
+    """
+    One LatencyHistogram per scrape step (page load, waiting for the video source, ...) and plain event counters,
+    shared by all threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, step, seconds):
+        with self.lock:
+            histogram = self.histograms.get(step)
+            if histogram is None:
+                histogram = self.histograms[step] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, step):
+        """
+        Context manager that records how long its block took under `step`, also if it raised.
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(step, time.monotonic() - started)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'latency': {step: histogram.as_dict() for step, histogram in sorted(self.histograms.items())},
+                'counts': dict(sorted(self.counters.items())),
+            }
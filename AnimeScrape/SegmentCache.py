@@ -0,0 +1,146 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+
+class SegmentCache:
+    """
+    Disk-backed LRU cache of .ts segments for the /ts_segment proxy, keyed by segment URL.
+
+    Seeks, rewatches, switching back to a resolution and several viewers of one episode request the same segments again,
+    hits are served from a file in `directory` instead of the CDN. A miss is written to the cache while it streams through
+    to its first client (`fill`), so caching costs no extra request. Only completely received segments are kept.
+
+    The files take at most `max_bytes`, the least recently used ones are deleted to make room. The LRU order is kept in
+    memory and in the files' modification times, so it survives restarts.
+
+    :param directory: Directory the segments are stored in, one file per segment named after the hash of its URL.
+    :param max_bytes: Byte budget of the cache.
+    """
+
+    def __init__(self, directory='segment_cache', max_bytes=2 * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self.total_bytes = 0
+        self.filling = set()  # Keys being written by `fill`
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def get(self, segment_url):
+        """
+        :return: The path of the cached segment, None on a miss.
+        """
+        key = self._key(segment_url)
+        with self.lock:
+            size = self.entries.get(key)
+            if size is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_saved += size
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # Evicted meanwhile, the caller's open fails and it fetches the segment
+        return path
+
+    def fill(self, segment_url, chunks):
+        """
+        Passes `chunks` through and writes them to the cache, the segment is added once all chunks were read.
+        If another request is filling the same segment already, the chunks are only passed through.
+        """
+        key = self._key(segment_url)
+        with self.lock:
+            filled_elsewhere = key in self.filling
+            if not filled_elsewhere:
+                self.filling.add(key)
+        if filled_elsewhere:
+            yield from chunks
+            return
+
+        temporary_path = self._path(key) + '.tmp'
+        size = 0
+        complete = False
+        try:
+            with open(temporary_path, 'wb') as file:
+                for chunk in chunks:
+                    file.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            # An incomplete segment (failed upstream, client went away) is not cached
+            if complete and 0 < size <= self.max_bytes:
+                self._add(key, temporary_path, size)
+            else:
+                self._remove(temporary_path)
+            with self.lock:
+                self.filling.discard(key)
+
+    def _add(self, key, temporary_path, size):
+        with self.lock:
+            os.replace(temporary_path, self._path(key))
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            while self.total_bytes > self.max_bytes:
+                evicted_key, evicted_size = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+                self._remove(self._path(evicted_key))
+
+    def _load(self):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp'):
+                self._remove(path)  # Left behind by a fill that was interrupted by a restart
+            elif name.endswith('.ts'):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name[:-3], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self._remove(self._path(key))
+        if self.entries:
+            logging.info(f'Segment cache: {len(self.entries)} segments ({self.total_bytes / 1e6:.1f} MB) in {self.directory}')
+
+    def _key(self, segment_url):
+        return hashlib.sha256(segment_url.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.ts')
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def get_stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / requests, 3) if requests else None,
+                'bytes_saved': self.bytes_saved,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,154 @@
+import os
+import time
+import random
+import shutil
+import hashlib
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from .SegmentManifest import SegmentManifest
+
+
+class SegmentFetcher:
+    """
+    Downloads the .ts segments of a media playlist concurrently and writes them, in playlist order, to one file.
+
+    Every worker streams its segment into a part file in `<output>.parts/`, so a worker holds one chunk in memory,
+    not a whole segment. The calling thread appends the parts to the output in playlist order as they complete.
+    At most `window` segments are fetched ahead of the first unfinished one, which bounds the disk the parts use.
+    A failed segment is retried `retries` times with jittered exponential backoff before the download is given up.
+
+    :param session: requests.Session the segments are fetched with, its connection pool should hold `workers` connections.
+    :param workers: Segments fetched at the same time.
+    :param retries: Retries per segment after a connection error, timeout or bad status.
+    :param backoff: First retry delay in seconds, doubled on every further retry.
+    :param window: Segments fetched ahead of the first unfinished one, by default 4 per worker.
+    :param bandwidth: Optional TokenBucket with a token per byte, every received chunk waits for its bytes.
+    """
+
+    def __init__(self, session, workers=8, retries=3, backoff=0.5, window=None, chunk_size=64 * 1024, timeout=30, bandwidth=None):
+        self.session = session
+        self.bandwidth = bandwidth
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.window = window or 4 * workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+        self.lock = threading.Lock()
+        self.num_retries = 0
+
+    def fetch(self, segment_urls, output_path, resume=False):
+        """
+        Downloads `segment_urls` into `output_path`.
+
+        :param resume: Keep a SegmentManifest of the appended segments next to the output (`<output>.manifest.jsonl`),
+                       and the parts that were fetched ahead, so a rerun after a failure continues with the first missing
+                       segment. The output is verified against the manifest once all segments were appended.
+        :return: Throughput stats of the download, see `_stats`. Segments done by an earlier run are not counted.
+        :raises requests.RequestException: If a segment still failed after its retries, the output is incomplete then.
+        :raises IncompleteDownloadError: If a resumed output does not match its manifest.
+        """
+        parts_path = output_path + '.parts'
+        started = time.monotonic()
+        retries_before = self.num_retries
+        num_bytes = 0
+
+        manifest = None
+        first = 0
+        if resume:
+            manifest = SegmentManifest(output_path + '.manifest.jsonl', len(segment_urls))
+            first = manifest.resume(output_path)
+        if not (manifest and manifest.loaded):
+            shutil.rmtree(parts_path, ignore_errors=True)  # Parts of another download
+        os.makedirs(parts_path, exist_ok=True)
+
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='segment-fetcher')
+        futures = {}
+        completed = False
+        try:
+            with open(output_path, 'r+b' if first else 'wb') as output:
+                output.seek(manifest.end if first else 0)
+                next_submit = first
+                for index in range(first, len(segment_urls)):
+                    while next_submit < len(segment_urls) and next_submit < index + self.window:
+                        part_path = os.path.join(parts_path, f'{next_submit}.ts')
+                        futures[next_submit] = executor.submit(self._fetch_segment, segment_urls[next_submit], part_path)
+                        next_submit += 1
+
+                    part_path = futures.pop(index).result()
+                    offset = output.tell()
+                    size, sha256 = self._append(part_path, output)
+                    num_bytes += size
+                    if manifest:
+                        output.flush()  # The bytes are in the file before the manifest says so
+                        manifest.add(index, offset, size, sha256)
+                    os.remove(part_path)
+            completed = True
+        finally:
+            for future in futures.values():
+                future.cancel()
+            executor.shutdown(wait=True)
+            if completed or not resume:
+                shutil.rmtree(parts_path, ignore_errors=True)
+
+        if manifest:
+            manifest.verify(output_path)
+        return self._stats(len(segment_urls) - first, num_bytes, time.monotonic() - started, self.num_retries - retries_before)
+
+    def _append(self, part_path, output):
+        sha256 = hashlib.sha256()
+        size = 0
+        with open(part_path, 'rb') as part:
+            while True:
+                data = part.read(1024 * 1024)
+                if not data:
+                    break
+                sha256.update(data)
+                output.write(data)
+                size += len(data)
+        return size, sha256.hexdigest()
+
+    def _fetch_segment(self, url, part_path):
+        if os.path.exists(part_path):
+            return part_path  # Fetched ahead by a run that failed on an earlier segment
+
+        # The segment is streamed into a temporary file that is renamed once complete,
+        # a retry asks for the rest of it with a Range request instead of starting over
+        temporary_path = part_path + '.tmp'
+        for attempt in range(self.retries + 1):
+            try:
+                received = os.path.getsize(temporary_path) if os.path.exists(temporary_path) else 0
+                headers = {'Range': f'bytes={received}-'} if received else None
+                with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    # A server that ignores the Range header sends the whole segment with 200
+                    with open(temporary_path, 'ab' if response.status_code == 206 else 'wb') as part:
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            if self.bandwidth:
+                                self.bandwidth.acquire(len(chunk))
+                            part.write(chunk)
+                os.replace(temporary_path, part_path)
+                return part_path
+            except requests.RequestException as e:
+                if attempt == self.retries:
+                    logging.error(f'Failed to download {url} after {attempt + 1} attempts: {e}')
+                    raise
+                delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                logging.warning(f'Failed to download {url} ({e}), retrying in {delay:.1f}s...')
+                with self.lock:
+                    self.num_retries += 1
+                time.sleep(delay)
+
+    def _stats(self, num_segments, num_bytes, seconds, num_retries):
+        return {
+            'segments': num_segments,
+            'bytes': num_bytes,
+            'seconds': round(seconds, 3),
+            'mb_per_second': round(num_bytes / 1e6 / seconds, 2) if seconds else None,
+            'segments_per_second': round(num_segments / seconds, 2) if seconds else None,
+            'retries': num_retries,
+            'workers': self.workers,
+        }
@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+import logging
+
+
+class IncompleteDownloadError(Exception):
+    """
+    Raised when a finished download does not match its manifest.
+    """
+
+
+class SegmentManifest:
+    """
+    Sidecar file of a resumable download. It holds one JSON line per segment that was appended to the output,
+    with the segment's byte offset, size and sha256, after a first line with the number of segments of the playlist.
+
+    Segments are appended in playlist order, so the entries are a prefix of the playlist and the output up to `end`
+    is the download so far. A rerun truncates the output to `end` and continues with the next segment.
+
+    :param path: The manifest file, `<output>.manifest.jsonl` by convention.
+    :param num_segments: Segments in the playlist, a manifest written for another number of segments is discarded.
+    """
+
+    def __init__(self, path, num_segments):
+        self.path = path
+        self.num_segments = num_segments
+        self.entries = []  # {'index', 'offset', 'size', 'sha256'}, entries[i] is segment i
+        self.loaded = False  # Whether `resume` found a manifest of this playlist
+
+    @property
+    def end(self):
+        return self.entries[-1]['offset'] + self.entries[-1]['size'] if self.entries else 0
+
+    def resume(self, output_path):
+        """
+        Loads the manifest and cuts the output back to the last segment that was fully written.
+
+        :return: The index of the first missing segment.
+        """
+        self._load()
+        output_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+        while self.entries and self.end > output_size:
+            self.entries.pop()  # Its manifest line was written but the output lost its bytes
+        if self.entries:
+            with open(output_path, 'r+b') as output:
+                output.truncate(self.end)
+            logging.info(f'Resuming {output_path} at segment {len(self.entries)}/{self.num_segments} ({self.end / 1e6:.1f} MB done)')
+        self._rewrite()
+        return len(self.entries)
+
+    def add(self, index, offset, size, sha256):
+        """
+        Records that segment `index` was appended to the output, call it after the output was flushed.
+        """
+        entry = {'index': index, 'offset': offset, 'size': size, 'sha256': sha256}
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(entry) + '\n')
+        self.entries.append(entry)
+
+    def verify(self, output_path):
+        """
+        Checks that every segment was appended and that the bytes at each entry's offset still hash to its sha256.
+        If not, the manifest and the output are cut back to the segment before the first bad one, so a rerun refetches from there.
+
+        :raises IncompleteDownloadError: If the output is incomplete or corrupt.
+        """
+        output_size = os.path.getsize(output_path)
+        first_bad = None
+        with open(output_path, 'rb') as output:
+            for entry in self.entries:
+                output.seek(entry['offset'])
+                if entry['offset'] + entry['size'] > output_size or hashlib.sha256(output.read(entry['size'])).hexdigest() != entry['sha256']:
+                    first_bad = entry['index']
+                    break
+        if first_bad is None and len(self.entries) < self.num_segments:
+            first_bad = len(self.entries)
+
+        if first_bad is not None:
+            del self.entries[first_bad:]
+            self._rewrite()
+            with open(output_path, 'r+b') as output:
+                output.truncate(self.end)
+            raise IncompleteDownloadError(f'{output_path} is incomplete from segment {first_bad} of {self.num_segments}, rerun the download to resume it')
+        if output_size > self.end:
+            with open(output_path, 'r+b') as output:
+                output.truncate(self.end)
+
+    def _load(self):
+        self.entries = []
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as file:
+            try:
+                header = json.loads(file.readline())
+            except ValueError:
+                header = {}
+            if header.get('segments') != self.num_segments:
+                logging.warning(f'{self.path} was written for another playlist, starting over')
+                return
+            self.loaded = True
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # An interrupted write leaves a partial last line behind
+                if entry.get('index') != len(self.entries) or entry.get('offset') != self.end:
+                    break
+                self.entries.append(entry)
+
+    def _rewrite(self):
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            file.write(json.dumps({'segments': self.num_segments}) + '\n')
+            for entry in self.entries:
+                file.write(json.dumps(entry) + '\n')
+        os.replace(temporary_path, self.path)
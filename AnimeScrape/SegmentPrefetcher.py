@@ -0,0 +1,116 @@
+import queue
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SegmentPrefetcher:
+    """
+    Streams the segments of a media playlist chunk by chunk in playlist order, while the next `read_ahead` segments
+    are already being fetched in the background.
+
+    Chunks fetched ahead wait in memory, `max_buffer` bytes at most. A worker that would go over it waits until the
+    consumer has caught up, so a slow client holds back the fetches instead of making the server buffer the episode.
+    Only the segment being streamed is never held back, which keeps a full buffer from blocking the stream itself.
+
+    A segment that fails is retried with a Range request for the bytes still missing, and skipped with a warning
+    if it still fails after `retries` retries, like the stream always did.
+
+    :param session: requests.Session the segments are fetched with, its pool should hold `read_ahead + 1` connections.
+    :param segment_urls: The segments, in playlist order.
+    :param read_ahead: Segments fetched ahead of the one being streamed.
+    :param max_buffer: Bytes of chunks fetched ahead that may wait in memory.
+    """
+
+    def __init__(self, session, segment_urls, read_ahead=4, max_buffer=32 * 1024 * 1024, chunk_size=64 * 1024,
+                 retries=2, timeout=30):
+        self.session = session
+        self.segment_urls = segment_urls
+        self.read_ahead = read_ahead
+        self.max_buffer = max_buffer
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.timeout = timeout
+
+        self.condition = threading.Condition()
+        self.buffered = 0  # Bytes in the queues, taken by workers and given back by the consumer
+        self.current = 0  # Index of the segment being streamed
+        self.closed = False
+        self.queues = [queue.Queue() for _ in segment_urls]  # Chunks of each segment, then None
+        self.executor = ThreadPoolExecutor(max_workers=read_ahead + 1, thread_name_prefix='segment-prefetcher')
+        self.submitted = 0
+
+    def __iter__(self):
+        try:
+            for index in range(len(self.segment_urls)):
+                self._submit_until(index + self.read_ahead)
+                while True:
+                    chunk = self.queues[index].get()
+                    if chunk is None:
+                        break
+                    self._release(len(chunk))
+                    yield chunk
+                with self.condition:
+                    self.current = index + 1
+                    self.condition.notify_all()
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stops the workers, called when the stream ends or the client went away.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit_until(self, last_index):
+        while self.submitted <= min(last_index, len(self.segment_urls) - 1):
+            self.executor.submit(self._fetch, self.submitted)
+            self.submitted += 1
+
+    def _fetch(self, index):
+        segment_url = self.segment_urls[index]
+        logging.info(f"Downloading segment {index + 1}/{len(self.segment_urls)}: {segment_url}")
+        received = 0
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    headers = {'Range': f'bytes={received}-'} if received else None
+                    with self.session.get(segment_url, headers=headers, stream=True, timeout=self.timeout) as response:
+                        response.raise_for_status()
+                        if received and response.status_code != 206:
+                            logging.warning(f"Segment {segment_url} can not be resumed, skipping the rest of it")
+                            return
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            if not self._reserve(index, len(chunk)):
+                                return  # Closed
+                            self.queues[index].put(chunk)
+                            received += len(chunk)
+                    return
+                except requests.RequestException as e:
+                    if attempt == self.retries:
+                        logging.warning(f"Failed to download segment {segment_url}: {e}")
+                    else:
+                        logging.info(f"Error downloading segment {segment_url} ({e}), retrying from byte {received}")
+        finally:
+            self.queues[index].put(None)
+
+    def _reserve(self, index, size):
+        """
+        Waits until `size` more bytes fit into the buffer, the segment being streamed does not wait.
+
+        :return: False if the prefetcher was closed meanwhile.
+        """
+        with self.condition:
+            while not self.closed and index != self.current and self.buffered + size > self.max_buffer:
+                self.condition.wait()
+            self.buffered += size
+            return not self.closed
+
+    def _release(self, size):
+        with self.condition:
+            self.buffered -= size
+            self.condition.notify_all()
@@ -0,0 +1,57 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs a function at most once per key at a time. Callers that ask for a key while its call is still running
+    wait for that call and get the same result, or the same exception, instead of running it again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}  # key -> _Call in flight
+        self.duplicates_avoided = 0
+
+    def do(self, key, function):
+        """
+        :return: What `function()` returned, for this caller or for the caller that was already running it.
+        :raises: What `function()` raised.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                self.duplicates_avoided += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'in_flight': len(self.calls),
+                'duplicates_avoided': self.duplicates_avoided,
+            }
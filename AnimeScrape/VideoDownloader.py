@@ -1,32 +1,48 @@
 import os
 import re
+import time
 import requests
 import m3u8
 import logging
 import json
 from urllib.parse import urljoin, quote
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from RateGovernor import TokenBucket
+from .EpisodeLinkStore import get_link_store
+from .SegmentFetcher import SegmentFetcher
+from .SegmentManifest import IncompleteDownloadError
 
 class VideoDownloader:
     """
     A class to download video chunks from a given base M3U8 URL.
     """
 
-    def __init__(self, headers_file="AnimeScrape/headers.json",  m3u8_json_file_path='m3u8/episode_links.json'):
+    def __init__(self, headers_file="AnimeScrape/headers.json",  m3u8_json_file_path='m3u8/episode_links.json',
+                 link_store_path='m3u8/episode_links.jsonl', segment_workers=8, bandwidth_limit=None):
         """
         Initialize the VideoDownloader instance.
 
         :param base_url: The URL of the base M3U8 file.
         :param output_file: The filename where the output video will be saved.
         :param headers_file: The path to the JSON file containing HTTP headers.
+        :param m3u8_json_file_path: The old JSON file of scraped m3u8 links, imported into the link store once.
+        :param link_store_path: The file the EpisodeLinkStore keeps the scraped m3u8 links in.
+        :param segment_workers: Segments `_download_chunks` downloads at the same time.
+        :param bandwidth_limit: Bytes per second all downloads of this instance share, None for no limit.
         """
         self.session = requests.Session()
         # Load headers from the JSON file
         self.session.headers.update(self._load_headers(headers_file))
+        # One pooled connection per segment worker, requests keeps 10 per host by default
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(10, segment_workers))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        bandwidth = TokenBucket(bandwidth_limit, bandwidth_limit) if bandwidth_limit else None
+        self.segment_fetcher = SegmentFetcher(self.session, workers=segment_workers, bandwidth=bandwidth)
 
         self.json_file_path = m3u8_json_file_path
-        if not os.path.exists(self.json_file_path):
-            with open(self.json_file_path, 'w') as f:
-                json.dump({}, f)
+        self.link_store = get_link_store(link_store_path, legacy_path=m3u8_json_file_path)
 
     def get_valid_filename(self,name):
         s = str(name).strip().replace(" ", "_")
@@ -36,21 +52,42 @@ class VideoDownloader:
         return s
 
 
-    def download_video(self, base_url, output_file):
+    def download_video(self, base_url, output_file, resume=True):
         """
         Coordinates the download process: get the M3U8 URL and download chunks.
+
+        :param resume: Continue an interrupted download of `output_file` instead of starting over, see `_download_chunks`.
+        :return: (message, status code) of `_download_chunks`, (error, 500) if the playlist could not be read.
         """
         try:
             # Get the highest resolution M3U8 URL
             m3u8_url = self.get_highest_resolution_m3u8_url(base_url)
 
             # Download all chunks and write them to a file
-            self._download_chunks(m3u8_url, output_file)
-
-            logging.info(f"Download completed. Video saved as {output_file}")
+            result = self._download_chunks(m3u8_url, output_file, resume=resume)
+            if result is None:
+                return "Encrypted streams can not be downloaded", 500
+            if result[1] == 200:
+                logging.info(f"Download completed. Video saved as {output_file}")
+            return result
 
         except Exception as e:
             logging.error(f"An error occurred: {e}")
+            return e, 500
+
+    def get_highest_resolution_m3u8_url(self, base_url):
+        """
+        :param base_url: The URL of the master M3U8 file.
+        :return: The URL of the variant playlist with the highest bandwidth, `base_url` if it is a media playlist already.
+        """
+        response = self.session.get(base_url)
+        response.raise_for_status()
+
+        master_playlist = m3u8.loads(response.text, uri=base_url)
+        if not master_playlist.is_variant:
+            return base_url
+        variant = max(master_playlist.playlists, key=lambda playlist: playlist.stream_info.bandwidth or 0)
+        return variant.absolute_uri
 
     def download_video_to_memory(self, video_source_url, buffer):
         # Download the m3u8 playlist
@@ -158,11 +195,13 @@ class VideoDownloader:
 
         raise ValueError(f"Resolution {desired_resolution} not found.")    
 
-    def _download_chunks(self, m3u8_url, output_file):
+    def _download_chunks(self, m3u8_url, output_file, resume=True):
         """
         Downloads the individual TS files from the M3U8 playlist and writes them to a single file.
 
         :param m3u8_url: The URL of the M3U8 file for the highest resolution stream.
+        :param resume: Keep a manifest of the written segments next to the file (`<output_file>.ts.manifest.jsonl`),
+                       so that a rerun after a failure continues with the first missing segment.
         """
         response = self.session.get(m3u8_url)
         response.raise_for_status()
@@ -185,24 +224,55 @@ class VideoDownloader:
                 logging.warning("Encryption detected but decryption is not implemented in this script.")
                 return
 
-        # Open the output file in binary write mode
-        anime_episode_folder = output_file.split('/')[0]
-        if not os.path.exists(anime_episode_folder):
-            os.makedirs(anime_episode_folder)
-        
-        with open(output_file+'.ts', 'wb') as f:
-            for segment in playlist.segments:
-                chunk_url = urljoin(m3u8_url, segment.uri)
-                try:
-                    chunk_response = self.session.get(chunk_url)
-                    chunk_response.raise_for_status()
-                    chunk_data = chunk_response.content
-                    f.write(chunk_data)
-                except requests.RequestException as e:
-                    logging.error(f"Failed to download {chunk_url}: {e}")
-                    return e, 500
+        anime_episode_folder = os.path.dirname(output_file)
+        if anime_episode_folder:
+            os.makedirs(anime_episode_folder, exist_ok=True)
+
+        # Download the segments concurrently, they are written to the file in playlist order
+        segment_urls = [urljoin(m3u8_url, segment.uri) for segment in playlist.segments]
+        try:
+            stats = self.segment_fetcher.fetch(segment_urls, output_file + '.ts', resume=resume)
+        except (requests.RequestException, IncompleteDownloadError) as e:
+            logging.error(f"Failed to download {m3u8_url}: {e}")
+            return e, 500
+        logging.info(f"Downloaded {stats['segments']} segments ({stats['bytes'] / 1e6:.1f} MB) in {stats['seconds']}s: "
+                     f"{stats['mb_per_second']} MB/s, {stats['segments_per_second']} segments/s, {stats['retries']} retries")
         return f"Success downloading {m3u8_url}", 200
 
+    def estimate_size(self, segments, bandwidth):
+        """
+        Estimates the bytes of a media playlist without a request: its #EXTINF durations times the variant's BANDWIDTH.
+        BANDWIDTH is the peak bit rate of the variant, so the estimate is an upper bound rather than exact.
+
+        :param segments: The m3u8 segments of the media playlist.
+        :param bandwidth: BANDWIDTH of the variant in bits per second.
+        :return: The estimated size in bytes, None without a bandwidth or durations.
+        """
+        duration = sum(segment.duration or 0 for segment in segments)
+        if not bandwidth or not duration:
+            return None
+        return int(duration * bandwidth / 8)
+
+    def probe_size(self, segment_urls, workers=None):
+        """
+        Adds up the Content-Length of HEAD requests to every segment, sent `workers` at a time over the pooled session.
+
+        :return: The size in bytes, None if a segment did not report its Content-Length.
+        """
+        def head(segment_url):
+            try:
+                response = self.session.head(segment_url, allow_redirects=True, timeout=10)
+                if response.status_code == 200 and response.headers.get('Content-Length'):
+                    return int(response.headers['Content-Length'])
+                logging.warning(f"Failed to get Content-Length for {segment_url}, Status Code: {response.status_code}")
+            except (requests.RequestException, ValueError) as e:
+                logging.warning(f"Error fetching HEAD for {segment_url}: {e}")
+            return None
+
+        with ThreadPoolExecutor(max_workers=workers or self.segment_fetcher.workers) as executor:
+            sizes = list(executor.map(head, segment_urls))
+        return None if None in sizes else sum(sizes)
+
     def get_m3u8_content(self, m3u8_url):
         """
         Fetches the m3u8 content from the given URL.
@@ -239,53 +309,13 @@ class VideoDownloader:
         return playlist.dumps()
     
 
-    # TODO: Implement database for saving m3u8 scraped links
     def save_m3u8_to_json(self, mal_anime_id, episode_number, m3u8_link):
-        """Save the m3u8 link to a JSON file."""
+        """Save the m3u8 link to the episode link store."""
         try:
-            # Load the existing data from the JSON file
-            with open(self.json_file_path, 'r') as f:
-                data = json.load(f)
-            
-            # Check if the anime ID already exists in the JSON, if not, create an entry
-            if str(mal_anime_id) not in data:
-                data[str(mal_anime_id)] = []
-
-            # Check if the episode is already stored, and update or append it
-            episode_exists = False
-            for episode in data[str(mal_anime_id)]:
-                if episode.get(str(episode_number)):
-                    episode[str(episode_number)] = m3u8_link
-                    episode_exists = True
-                    break
-
-            if not episode_exists:
-                # Append new episode and link
-                data[str(mal_anime_id)].append({str(episode_number): m3u8_link})
-            
-            # Save the updated data back to the JSON file
-            with open(self.json_file_path, 'w') as f:
-                json.dump(data, f, indent=4)
-        
+            self.link_store.save(mal_anime_id, episode_number, m3u8_link, fetched_at=time.time(), state='valid')
         except Exception as e:
-            print(f"Error saving m3u8 link to JSON: {e}")
+            print(f"Error saving m3u8 link: {e}")
 
     def get_m3u8_from_json(self, mal_anime_id, episode_number):
-        """Retrieve the m3u8 link from the JSON file."""
-        try:
-            # Load the existing data from the JSON file
-            with open(self.json_file_path, 'r') as f:
-                data = json.load(f)
-            
-            # Find the anime ID and episode number
-            anime_data = data.get(str(mal_anime_id), [])
-            for episode in anime_data:
-                if episode.get(str(episode_number)):
-                    return episode[str(episode_number)]
-            
-            # If not found, return None
-            return None
-        
-        except Exception as e:
-            print(f"Error retrieving m3u8 link from JSON: {e}")
-            return None
+        """Retrieve the m3u8 link from the episode link store, None if it was not saved or has expired."""
+        return self.link_store.get_link(mal_anime_id, episode_number)
@@ -0,0 +1,186 @@
+import os
+import json
+import logging
+import sqlite3
+import time
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JsonDirectoryStore:
+    """
+    The original storage layout: one `<directory>/<id>.json` file per anime.
+    """
+
+    def __init__(self, directory='animes'):
+        self.directory = directory
+
+    def _path(self, anime_id):
+        return os.path.join(self.directory, f'{anime_id}.json')
+
+    def exists(self, anime_id):
+        return os.path.exists(self._path(anime_id))
+
+    def load(self, anime_id):
+        file_path = self._path(anime_id)
+        if os.path.exists(file_path):
+            with open(file_path, 'r') as file:
+                return json.load(file)
+        return None
+
+    def load_all(self, workers=8):
+        # File reads release the GIL, so reading them from a few threads overlaps the disk waits
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(self.load, self.ids()))
+
+    def ids(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [int(name[:-5]) for name in os.listdir(self.directory) if name.endswith('.json') and name[:-5].isdigit()]
+
+    def load_fetched_at(self):
+        # The file's modification time is when the anime was last written from a MAL response
+        return {anime_id: os.path.getmtime(self._path(anime_id)) for anime_id in self.ids()}
+
+    def save(self, info):
+        self.save_many([info])
+
+    def save_many(self, infos):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        for info in infos:
+            with open(self._path(info['id']), 'w') as file:
+                json.dump(info, file, indent=4)
+
+    def touch(self, anime_ids):
+        for anime_id in anime_ids:
+            if self.exists(anime_id):
+                os.utime(self._path(anime_id))
+
+    @contextmanager
+    def batch(self):
+        yield
+
+
+class SqliteAnimeStore:
+    """
+    All animes in a single SQLite file, one row per anime keyed by its MAL id,
+    together with the time it was last fetched from MAL.
+
+    Writes made inside `with store.batch():` are buffered and committed in one transaction when the block exits.
+    The connection is shared between threads and guarded by a lock.
+    """
+
+    def __init__(self, path='animes.db'):
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS animes (id INTEGER PRIMARY KEY, data TEXT NOT NULL, fetched_at REAL)')
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(animes)')]
+        if 'fetched_at' not in columns:
+            self.connection.execute('ALTER TABLE animes ADD COLUMN fetched_at REAL')
+        self.connection.commit()
+        self.batch_depth = 0
+        self.pending = {}
+
+    def exists(self, anime_id):
+        with self.lock:
+            if anime_id in self.pending:
+                return True
+            row = self.connection.execute('SELECT 1 FROM animes WHERE id = ?', (anime_id,)).fetchone()
+        return row is not None
+
+    def load(self, anime_id):
+        with self.lock:
+            if anime_id in self.pending:
+                return self.pending[anime_id]
+            row = self.connection.execute('SELECT data FROM animes WHERE id = ?', (anime_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def load_all(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT data FROM animes').fetchall()
+        # One json.loads over all rows joined into an array is a single pass of the C decoder
+        return json.loads('[' + ','.join(data for data, in rows) + ']')
+
+    def ids(self):
+        with self.lock:
+            return [anime_id for anime_id, in self.connection.execute('SELECT id FROM animes')]
+
+    def load_fetched_at(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT id, fetched_at FROM animes').fetchall()
+        return {anime_id: fetched_at or 0.0 for anime_id, fetched_at in rows}
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM animes').fetchone()[0]
+
+    def save(self, info):
+        with self.lock:
+            if self.batch_depth:
+                self.pending[info['id']] = info
+                return
+        self.save_many([info])
+
+    def save_many(self, infos):
+        now = time.time()
+        self._write([(info['id'], json.dumps(info), now) for info in infos])
+
+    def _write(self, rows):
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO animes (id, data, fetched_at) VALUES (?, ?, ?)', rows)
+
+    def touch(self, anime_ids):
+        """
+        Marks animes as fetched now, without rewriting their data.
+        """
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany('UPDATE animes SET fetched_at = ? WHERE id = ?', [(now, anime_id) for anime_id in anime_ids])
+
+    @contextmanager
+    def batch(self):
+        with self.lock:
+            self.batch_depth += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.batch_depth -= 1
+                if self.batch_depth == 0 and self.pending:
+                    pending, self.pending = self.pending, {}
+                    self.save_many(list(pending.values()))
+
+    def import_json_directory(self, directory='animes'):
+        """
+        Imports every `<directory>/<id>.json` file written by the JsonDirectoryStore, in one transaction.
+
+        :return: The number of imported animes.
+        """
+        legacy_store = JsonDirectoryStore(directory)
+        fetched_at = legacy_store.load_fetched_at()
+        rows = []
+        for info in legacy_store.load_all():
+            if info and 'id' in info:
+                rows.append((info['id'], json.dumps(info), fetched_at.get(info['id'], 0.0)))
+        self._write(rows)
+        logging.info(f'Imported {len(rows)} animes from {directory}/ into {self.path}')
+        return len(rows)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def open_default_store(path='animes.db', legacy_directory='animes'):
+    """
+    Opens the SQLite store, importing the legacy one-file-per-anime directory the first time.
+    """
+    store = SqliteAnimeStore(path)
+    if store.count() == 0 and os.path.isdir(legacy_directory):
+        store.import_json_directory(legacy_directory)
+    return store
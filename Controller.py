@@ -1,11 +1,11 @@
-import io, time, m3u8, os
+import io, time, m3u8, os, json
 import webbrowser
 import threading
 import logging
 import requests
 from datetime import datetime, timedelta
 
-from flask import Flask, Response, request, session, redirect, url_for, stream_with_context, jsonify, render_template, g
+from flask import Flask, Response, request, session, redirect, url_for, stream_with_context, jsonify, render_template, g, send_file
 from flask_session import Session
 from werkzeug.serving import make_server
 
@@ -13,14 +13,40 @@ from MalAuthenticator import TokenGenerator, TokenLoader
 from MalRequester import Requester
 from AnimeScrape.VideoDownloader import VideoDownloader
 from AnimeScrape.AnimeScraper import AnimeScraper
+from AnimeScrape.EpisodeDataCache import EpisodeDataCache
+from AnimeScrape.SingleFlight import SingleFlight
+from AnimeScrape.ScrapeMetrics import ScrapeMetrics
+from AnimeScrape.SegmentPrefetcher import SegmentPrefetcher
+from AnimeScrape.SegmentCache import SegmentCache
+from AnimeScrape.LinkRevalidator import LinkRevalidator
+from AnimeScrape.DownloadQueue import DownloadQueue
+from AnimeRepository import get_anime_catalog
 
 
 class AnimeController:
     logging.basicConfig(level=logging.info)
 
-    def __init__(self):
+    def __init__(self, prefill_anilist_mapping=True, max_downloads=2, download_bandwidth_limit=None, download_read_ahead=4,
+                 segment_cache_bytes=2 * 1024 ** 3):
         self.scraper = AnimeScraper()
+        # Look up the AniList ids of the whole anime catalog once its build is done, so watching needs no lookup
+        self.prefill_anilist_mapping = prefill_anilist_mapping
+        # Episode lists and airing dates are the same for every user, one scrape per anime and TTL serves all sessions
+        self.episode_data_cache = EpisodeDataCache()
+        self.watch_scrapes = SingleFlight()  # In-flight /watch_anime scrapes by (MAL id, episode)
+        self.download_metrics = ScrapeMetrics()  # /download_anime time to headers and to the first byte
+        self.download_read_ahead = download_read_ahead  # Segments /download_anime fetches ahead of the one it streams
+        # /ts_segment keeps the segments it proxied on disk, `segment_cache_bytes` at most, and reuses one connection pool
+        self.segment_cache = SegmentCache(max_bytes=segment_cache_bytes)
+        self.segment_session = requests.Session()
         self.downloader = VideoDownloader()
+        # Probes the links of the episodes being watched and re-scrapes them before they expire
+        self.link_revalidator = LinkRevalidator(self.downloader.link_store, self.refresh_video_source, self.downloader.session)
+        self.link_revalidator.start()
+        # Batch downloads of episode ranges and lineages, `download_bandwidth_limit` bytes/s are shared by all of them
+        self.download_queue = DownloadQueue(VideoDownloader(bandwidth_limit=download_bandwidth_limit), self.resolve_download_source,
+                                            self.count_episodes, get_anime_catalog(), max_downloads=max_downloads)
+        self.download_queue.start()
         self.server = None
         self.app = Flask(__name__, template_folder='templates', static_folder='webapp/static')
         self.token_path = 'src/tokens.json'
@@ -37,17 +63,100 @@ class AnimeController:
         threading.Thread(target=self.run_flask).start()
 
 
+    def prefill_anilist_ids(self, requester):
+        """
+        Waits for the requester's database build and maps every anime of the catalog to its AniList id.
+        """
+        requester.build_done.wait()
+        try:
+            self.scraper.anilist_mapping.prefill(list(requester.anime_repo.animes))
+        except Exception as e:
+            logging.error(f"Error prefilling the AniList mapping: {e}", exc_info=True)
+
+    def scrape_video_source(self, mal_anime_id, episode_number, force=False):
+        """
+        Scrapes the m3u8 link of an episode and saves it, so later requests skip scraping.
+
+        :param force: Scrape even if a link is saved, to replace one that is about to expire.
+        :return: (m3u8 link, None), or (None, (error message, status code)) if the episode could not be found.
+        """
+        # A scrape that finished just before this one was started may have saved the link already
+        saved_m3u8_link = None if force else self.downloader.get_m3u8_from_json(mal_anime_id, episode_number)
+        if saved_m3u8_link:
+            return saved_m3u8_link, None
+
+        # Get the AniList ID and anime name from MAL ID
+        print(f"SCRAPING ANIME: {mal_anime_id} - EP.{episode_number}...")
+        anime_id, anime_name = self.scraper.get_anilist_id_from_mal(mal_anime_id)
+        print(f"RECIEVED ANIME ID (AND NAME) TO SCRAPE WITH: ID: {anime_id} ({anime_name}).")
+        # Get the base m3u8 URL (master playlist)
+        m3u8_link = self.scraper.get_video_source_url_selenium(anime_id, episode_number)
+        if not m3u8_link:
+            return None, ("Video source URL not found", 404)
+
+        # Compare episode number to requested episode number
+        actual_ep = self.scraper.extract_episode_from_video_url(m3u8_link)
+        if  int(actual_ep) - int(episode_number) != 0:
+            print(f'FOUND: EP{actual_ep}, BUT EXPECTED: EP{episode_number}')
+            return None, (f"Requested episode {episode_number} not found, could only find episode: {actual_ep}.\n If the episode found is the previous of the requested episode,\n then the anime is still airing and the episode not available yet", 417)
+
+        # Save the m3u8 URL to JSON to skip scraping for later requests
+        self.downloader.save_m3u8_to_json(mal_anime_id, episode_number, m3u8_link)
+        return m3u8_link, None
+
+    def refresh_video_source(self, mal_anime_id, episode_number):
+        """
+        Re-scrapes the m3u8 link of an episode for the LinkRevalidator.
+        Goes through watch_scrapes, so a playback start of the same episode waits for it instead of scraping too.
+
+        :return: The new m3u8 link, or None if the episode could not be scraped.
+        """
+        m3u8_link, error = self.watch_scrapes.do(
+            (mal_anime_id, episode_number), lambda: self.scrape_video_source(mal_anime_id, episode_number, force=True))
+        if error:
+            logging.warning(f"Could not re-scrape {mal_anime_id} EP.{episode_number}: {error[0]}")
+        return m3u8_link
+
+    def resolve_download_source(self, mal_anime_id, episode_number):
+        """
+        The m3u8 link of an episode for the DownloadQueue, scraped through watch_scrapes like a playback start.
+        """
+        return self.watch_scrapes.do(
+            (mal_anime_id, episode_number), lambda: self.scrape_video_source(mal_anime_id, episode_number))
+
+    def count_episodes(self, mal_anime_id):
+        """
+        :return: The number of episodes of an anime: from MAL for finished ones, else the episodes available on the site.
+        """
+        anime = get_anime_catalog().get_anime_by_id(mal_anime_id)
+        if anime is not None and anime.num_episodes and anime.status == 'finished_airing':
+            return anime.num_episodes
+        episode_data = self.episode_data_cache.get(mal_anime_id, self.scraper.get_episode_data)
+        return len(episode_data.get('availableEpisodes', [])) if episode_data else 0
+
     def proxy_ts_segment(self, segment_url):
         """
-        Proxies the .ts segment to the client.
+        Proxies the .ts segment to the client, from the segment cache if it holds it.
         """
         try:
+            cached_path = self.segment_cache.get(segment_url)
+            if cached_path:
+                try:
+                    # Served as a file, which the WSGI server can hand to sendfile, and with Range support
+                    return send_file(cached_path, mimetype='video/mp2t', conditional=True)
+                except FileNotFoundError:
+                    pass  # Evicted since the lookup
+
             headers = {}  # Add any required headers here
 
             # Stream the content to the client
-            req = requests.get(segment_url, headers=headers, stream=True)
+            req = self.segment_session.get(segment_url, headers=headers, stream=True)
+            chunks = req.iter_content(chunk_size=64 * 1024)
+            if req.status_code == 200:
+                # The segment is written to the cache while it streams to this first client
+                chunks = self.segment_cache.fill(segment_url, chunks)
 
-            return Response(stream_with_context(req.iter_content(chunk_size=8192)), content_type=req.headers['Content-Type'])
+            return Response(stream_with_context(chunks), status=req.status_code, content_type=req.headers.get('Content-Type', 'video/mp2t'))
         except Exception as e:
             logging.error(f"Error proxying segment {segment_url}: {e}")
             return str(e), 500
@@ -89,11 +198,14 @@ class AnimeController:
             session['tokens']['refresh_token'] = tokens_loader.refresh_token
             session['tokens']['expires_at'] = tokens_loader.expires_at
 
-            if user_id not in self.requesters:
-                requester = Requester(tokens_loader=tokens_loader)
+            requester = self.requesters.get(user_id)
+            # A build that failed (MAL unreachable, revoked tokens) is started over with the tokens of this login
+            if requester is None or requester.state == 'failed':
+                # Build the database in the background, so the page renders right away and fills up via /build_progress
+                requester = Requester(tokens_loader=tokens_loader, background=True)
                 self.requesters[user_id] = requester
-            else:
-                requester = self.requesters[user_id]
+                if self.prefill_anilist_mapping:
+                    threading.Thread(target=self.prefill_anilist_ids, args=(requester,), daemon=True).start()
 
             g.requester = requester
             return render_template('index.html')
@@ -289,7 +401,7 @@ class AnimeController:
                 JSON response containing 'availableEpisodes' and 'nextAiringDate'.
             """
             try:
-                episode_data = self.scraper.get_episode_data(mal_anime_id)
+                episode_data = self.episode_data_cache.get(mal_anime_id, self.scraper.get_episode_data)
                 available_episodes = episode_data.get('availableEpisodes', [])
                 next_airing_date = episode_data.get('nextAiringDate')
 
@@ -350,11 +462,8 @@ class AnimeController:
             if not requester:
                 return redirect(url_for('index'))
             try:
-                anime_objs_json = {} 
-                for anime in requester.anime_repo.get_all_animes():
-                    anime_objs_json[anime.id] = anime.to_dict()
-
-                return jsonify(anime_objs_json)
+                # The user's animes and their lineages from the shared catalog, with the user's list status
+                return jsonify(requester.user_list.get_animes())
 
             except Exception as e:
                 logging.error(f"Error rendering template: {e}")
@@ -366,7 +475,7 @@ class AnimeController:
             if not requester:
                 return redirect(url_for('index'))
             try:
-                return jsonify(requester.anime_repo.user_anime_list)
+                return jsonify(requester.user_list.anime_ids)
 
             except Exception as e:
                 logging.error(f"Error rendering template: {e}")
@@ -378,6 +487,8 @@ class AnimeController:
             if not requester:
                 return redirect(url_for('index'))
             try:
+                if not requester.build_done.is_set():
+                    return "BUILD IN PROGRESS", 202  # The build loads the user list itself
                 requester.get_user_anime_list() # TODO: RENAME REFRESH ANIME
                 return "SUCCESSFUL", 200
 
@@ -385,14 +496,47 @@ class AnimeController:
                 logging.error(f"Error rendering template: {e}")
                 return str(e), 500  
 
+        @self.app.route('/build_progress')
+        def build_progress():
+            requester = g.requester
+            if not requester:
+                return jsonify({'error': 'No database build for this session.'}), 404
+            return jsonify(requester.get_progress()), 200
+
+        @self.app.route('/build_progress/stream')
+        def build_progress_stream():
+            """
+            Server-sent events with the progress of the user's database build, one event per change, until it is done.
+            """
+            requester = g.requester
+            if not requester:
+                return jsonify({'error': 'No database build for this session.'}), 404
+
+            def generate():
+                last_progress = None
+                while True:
+                    progress = requester.get_progress()
+                    if progress != last_progress:
+                        yield f"data: {json.dumps(progress)}\n\n"
+                        last_progress = progress
+                    if progress['done']:
+                        break
+                    requester.build_done.wait(1)
+
+            return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
         @self.app.route('/lineage_data')
         def lineage_data():
             requester = g.requester
             if not requester:
                 return redirect(url_for('index'))
             try:
-                lineage = requester.anime_repo.generate_anime_seasons_liniage()
-                return jsonify(lineage)
+                # The lineage index and user list versions double as ETag, so unchanged lineages cost the client a 304
+                version, body = requester.user_list.get_lineages_json()
+                etag = f'"lineage-{version}"'
+                if etag in request.headers.get('If-None-Match', ''):
+                    return Response(status=304, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+                return Response(body, mimetype='application/json', headers={'ETag': etag, 'Cache-Control': 'no-cache'})
             except Exception as e:
                 logging.error(f"Error generating lineage data: {e}")
                 return str(e), 500
@@ -400,19 +544,39 @@ class AnimeController:
             
         @self.app.route('/download_anime/<int:mal_anime_id>/<int:episode_number>')
         def download_anime(mal_anime_id, episode_number):
+            """
+            Streams an episode as one .ts file.
+
+            The optional 'size' query parameter decides how the size of the file is told to the client:
+            - 'estimate' (default): no request is made, the size estimated from the #EXTINF durations and the variant's
+              bandwidth is sent as X-Estimated-Content-Length, the body is sent with chunked transfer encoding,
+            - 'probe': HEAD requests to all segments, sent concurrently, give the exact Content-Length,
+            - 'none': chunked transfer encoding without any size.
+            """
+            started = time.monotonic()
+            size_mode = request.args.get('size', 'estimate')
+            if size_mode not in ('estimate', 'probe', 'none'):
+                return "Invalid size parameter, use estimate, probe or none", 400
             try:
-                # Step 1: Retrieve Anime Information
+                # Step 1: Retrieve Anime Information, the saved m3u8 link is used if there is one
                 anime_id, anime_name = self.scraper.get_anilist_id_from_mal(mal_anime_id)
-                video_source_url = self.scraper.get_video_source_url_selenium(anime_id, episode_number)
+                video_source_url, error = self.resolve_download_source(mal_anime_id, episode_number)
 
                 if not video_source_url:
                     logging.error(f"Video source URL not found for MAL ID {mal_anime_id}, Episode {episode_number}")
-                    return "Video source URL not found", 404
+                    return error or ("Video source URL not found", 404)
 
                 logging.info(f"Initiating download for Anime ID: {anime_id}, Name: {anime_name}")
 
                 # Step 2: Download and Parse the .m3u8 Playlist with base_uri
-                playlist_response = requests.get(video_source_url)
+                playlist_response = self.downloader.session.get(video_source_url)
+                if playlist_response.status_code in (403, 404, 410):
+                    # The saved link expired, scrape a new one
+                    self.downloader.link_store.set_state(mal_anime_id, episode_number, 'expired', video_source_url)
+                    video_source_url, error = self.resolve_download_source(mal_anime_id, episode_number)
+                    if error:
+                        return error
+                    playlist_response = self.downloader.session.get(video_source_url)
                 if playlist_response.status_code != 200:
                     logging.error(f"Failed to download m3u8 playlist from {video_source_url}, Status Code: {playlist_response.status_code}")
                     return "Failed to download video playlist", 500
@@ -424,9 +588,8 @@ class AnimeController:
                 playlist = m3u8.loads(playlist_content, uri=video_source_url)
                 logging.info(f"Parsed m3u8 playlist: {len(playlist.segments)} segments found")
 
-                # Initialize variables
-                total_size = 0
-                segment_urls = []
+                bandwidth = None
+                media_playlist = playlist
 
                 if playlist.is_variant:
                     logging.info("Playlist is a master playlist. Selecting the highest quality variant.")
@@ -434,11 +597,12 @@ class AnimeController:
                     # Sort variants by bandwidth in descending order and select the highest
                     variants = sorted(playlist.playlists, key=lambda p: p.stream_info.bandwidth, reverse=True)
                     selected_variant = variants[0]  # Highest bandwidth
+                    bandwidth = selected_variant.stream_info.bandwidth
                     variant_url = selected_variant.absolute_uri
                     logging.info(f"Selected variant playlist URL: {variant_url}")
 
                     # Download the variant playlist
-                    variant_response = requests.get(variant_url)
+                    variant_response = self.downloader.session.get(variant_url)
                     if variant_response.status_code != 200:
                         logging.error(f"Failed to download variant playlist from {variant_url}, Status Code: {variant_response.status_code}")
                         return "Failed to download variant playlist", 500
@@ -447,56 +611,33 @@ class AnimeController:
                     logging.debug(f"Variant Playlist Content:\n{variant_content}")
 
                     # Parse the variant playlist with base_uri set to variant_url
-                    variant_playlist = m3u8.loads(variant_content, uri=variant_url)
-                    logging.info(f"Parsed variant playlist: {len(variant_playlist.segments)} segments found")
-
-                    # Collect all segment URLs
-                    for segment in variant_playlist.segments:
-                        segment_urls.append(segment.absolute_uri)
-
+                    media_playlist = m3u8.loads(variant_content, uri=variant_url)
+                    logging.info(f"Parsed variant playlist: {len(media_playlist.segments)} segments found")
                 else:
-                    # It's a media playlist
                     logging.info("Playlist is a media playlist.")
-                    for segment in playlist.segments:
-                        segment_urls.append(segment.absolute_uri)
 
-                # Step 3: Calculate the total size by sending HEAD requests
-                logging.info("Calculating total download size by sending HEAD requests to each segment.")
-                for segment_url in segment_urls:
-                    try:
-                        head = requests.head(segment_url, allow_redirects=True)
-                        if head.status_code == 200:
-                            size = int(head.headers.get('Content-Length', 0))
-                            total_size += size
-                        else:
-                            logging.warning(f"Failed to get Content-Length for {segment_url}, Status Code: {head.status_code}")
-                    except Exception as e:
-                        logging.warning(f"Error fetching HEAD for {segment_url}: {e}")
-
-                if total_size == 0:
-                    logging.warning("Could not determine total size. Proceeding without Content-Length.")
-                    content_length = None
-                else:
-                    content_length = total_size
-
-                # Step 4: Define the generator
-                def generate():
-                    for idx, segment_url in enumerate(segment_urls):
-                        logging.info(f"Downloading segment {idx + 1}/{len(segment_urls)}: {segment_url}")
+                # Collect all segment URLs
+                segment_urls = [segment.absolute_uri for segment in media_playlist.segments]
 
-                        try:
-                            segment_response = requests.get(segment_url, stream=True)
-                            if segment_response.status_code != 200:
-                                logging.warning(f"Failed to download segment {segment_url}, Status Code: {segment_response.status_code}")
-                                continue  # Skip to the next segment
+                # Step 3: Size the download without holding back the response
+                content_length = None
+                estimated_length = None
+                if size_mode == 'probe':
+                    content_length = self.downloader.probe_size(segment_urls)
+                    if content_length is None:
+                        logging.warning("Could not determine total size. Proceeding with the estimate.")
+                if size_mode != 'none' and content_length is None:
+                    estimated_length = self.downloader.estimate_size(media_playlist.segments, bandwidth)
 
-                            for chunk in segment_response.iter_content(chunk_size=8192):
-                                if chunk:
-                                    yield chunk  # Stream chunk to client
-
-                        except Exception as e:
-                            logging.warning(f"Error downloading segment {segment_url}: {e}")
-                            continue  # Skip to the next segment
+                # Step 4: Define the generator, the next segments are fetched while the current one streams
+                def generate():
+                    first_byte = True
+                    prefetcher = SegmentPrefetcher(self.downloader.session, segment_urls, read_ahead=self.download_read_ahead)
+                    for chunk in prefetcher:
+                        if first_byte:
+                            self.download_metrics.observe('download_anime.ttfb', time.monotonic() - started)
+                            first_byte = False
+                        yield chunk  # Stream chunk to client
 
                 # Step 5: Generate a Valid Filename
                 anime_name_clean = self.downloader.get_valid_filename(anime_name)
@@ -510,8 +651,12 @@ class AnimeController:
 
                 if content_length:
                     headers['Content-Length'] = str(content_length)
+                elif estimated_length:
+                    # Not Content-Length: the estimate is not exact, a client would wait for missing bytes or cut the file
+                    headers['X-Estimated-Content-Length'] = str(estimated_length)
 
-                logging.info(f"Serving file {filename} to the client with Content-Length={content_length}")
+                logging.info(f"Serving file {filename} to the client with Content-Length={content_length}, estimate={estimated_length}")
+                self.download_metrics.observe(f'download_anime.headers.{size_mode}', time.monotonic() - started)
 
                 return Response(
                     stream_with_context(generate()),
@@ -527,35 +672,31 @@ class AnimeController:
         def watch_anime(mal_anime_id, episode_number):
             try:
                 resolution = request.args.get('resolution')
-                saved_m3u8_link = self.downloader.get_m3u8_from_json(mal_anime_id, episode_number)
-                if saved_m3u8_link:
-                    video_source_url = saved_m3u8_link
-                else:
-                    # Get the AniList ID and anime name from MAL ID
-                    print(f"SCRAPING ANIME: {mal_anime_id} - EP.{episode_number}...")
-                    anime_id, anime_name = self.scraper.get_anilist_id_from_mal(mal_anime_id)
-                    print(f"RECIEVED ANIME ID (AND NAME) TO SCRAPE WITH: ID: {anime_id} ({anime_name}).")
-                    # Get the base m3u8 URL (master playlist)
-                    m3u8_link = self.scraper.get_video_source_url_selenium(anime_id, episode_number)
-                    if not m3u8_link:
-                        return "Video source URL not found", 404
-                    
-                    # Compare episode number to requested episode number
-                    actual_ep = self.scraper.extract_episode_from_video_url(m3u8_link)
-                    if  int(actual_ep) - int(episode_number) != 0:
-                        print(f'FOUND: EP{actual_ep}, BUT EXPECTED: EP{episode_number}')
-                        return f"Requested episode {episode_number} not found, could only find episode: {actual_ep}.\n If the episode found is the previous of the requested episode,\n then the anime is still airing and the episode not available yet", 417
-
-                    # Save the m3u8 URL to JSON to skip scraping for later requests
-                    self.downloader.save_m3u8_to_json(mal_anime_id, episode_number, m3u8_link)
-                    video_source_url = m3u8_link
+                video_source_url = self.downloader.get_m3u8_from_json(mal_anime_id, episode_number)
+                if not video_source_url:
+                    # Requests for an episode that is already being scraped wait for that scrape instead of starting their own
+                    video_source_url, error = self.watch_scrapes.do(
+                        (mal_anime_id, episode_number), lambda: self.scrape_video_source(mal_anime_id, episode_number))
+                    if error:
+                        return error
 
                 if not video_source_url:
                     return 'Video source could not be found.', 404
                 
                 if resolution:
                     # Fetch m3u8 URL for the specified resolution
-                    m3u8_url = self.downloader.get_m3u8_url_by_resolution(video_source_url, resolution)
+                    try:
+                        m3u8_url = self.downloader.get_m3u8_url_by_resolution(video_source_url, resolution)
+                    except requests.HTTPError as e:
+                        if e.response is None or e.response.status_code not in (403, 404, 410):
+                            raise
+                        # The link expired since the revalidator last probed it, mark it and scrape a new one
+                        self.downloader.link_store.set_state(mal_anime_id, episode_number, 'expired', video_source_url)
+                        video_source_url, error = self.watch_scrapes.do(
+                            (mal_anime_id, episode_number), lambda: self.scrape_video_source(mal_anime_id, episode_number))
+                        if error:
+                            return error
+                        m3u8_url = self.downloader.get_m3u8_url_by_resolution(video_source_url, resolution)
                 else:
                     return 'Resolution parameter is missing.', 400
 
@@ -589,6 +730,66 @@ class AnimeController:
                 logging.error(f"Error fetching available resolutions: {e}")
                 return jsonify({"error": str(e)}), 500
 
+        @self.app.route('/api/metrics', methods=['GET'])
+        def metrics():
+            """
+            Scraper latency histograms per step and counters, the state of the browser pool, of the scrape caches,
+            of the stored episode links and their revalidation, of the download queue and /download_anime latencies,
+            and the hit ratio and bytes saved of the /ts_segment cache.
+            """
+            return jsonify({
+                'scraper': self.scraper.metrics.get_stats(),
+                'driver_pool': self.scraper.driver_pool.get_stats(),
+                'anilist_mapping': self.scraper.anilist_mapping.get_stats(),
+                'episode_data_cache': self.episode_data_cache.get_stats(),
+                'watch_scrapes': self.watch_scrapes.get_stats(),
+                'episode_links': dict(self.downloader.link_store.get_stats(), **self.link_revalidator.get_stats()),
+                'download_queue': self.download_queue.get_stats(),
+                'download_anime': self.download_metrics.get_stats(),
+                'segment_cache': self.segment_cache.get_stats(),
+            }), 200
+
+        @self.app.route('/api/downloads', methods=['GET'])
+        def get_downloads():
+            return jsonify({'jobs': self.download_queue.get_jobs()}), 200
+
+        @self.app.route('/api/downloads', methods=['POST'])
+        def add_download():
+            """
+            Queues a batch download. The JSON body holds either
+            - 'malAnimeId' with optional 'firstEpisode' (default 1) and 'lastEpisode' (default: all episodes), or
+            - 'lineageId', the first season of a lineage (a key of /lineage_data), to download all of its seasons.
+            """
+            data = request.get_json(silent=True) or {}
+            try:
+                if data.get('lineageId') is not None:
+                    job = self.download_queue.add_lineage(data['lineageId'])
+                elif data.get('malAnimeId') is not None:
+                    job = self.download_queue.add_episodes(data['malAnimeId'], data.get('firstEpisode', 1), data.get('lastEpisode'))
+                else:
+                    return jsonify({'error': 'Missing malAnimeId or lineageId field.'}), 400
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            except Exception as e:
+                logging.error(f"Error queueing download: {e}", exc_info=True)
+                return jsonify({'error': 'Internal Server Error'}), 500
+            return jsonify(job), 201
+
+        @self.app.route('/api/downloads/<int:job_id>', methods=['GET'])
+        def get_download(job_id):
+            job = self.download_queue.get_job(job_id, with_tasks=True)
+            if job is None:
+                return jsonify({'error': 'Download job not found.'}), 404
+            return jsonify(job), 200
+
+        @self.app.route('/api/downloads/<int:job_id>/cancel', methods=['POST'])
+        def cancel_download(job_id):
+            return jsonify({'cancelled': self.download_queue.cancel(job_id)}), 200
+
+        @self.app.route('/api/downloads/<int:job_id>/retry', methods=['POST'])
+        def retry_download(job_id):
+            return jsonify({'queued': self.download_queue.retry(job_id)}), 200
+
         @self.app.route('/ts_segment')
         def ts_segment():
             # URL of the .ts segment to fetch
@@ -601,6 +802,7 @@ class AnimeController:
 
 
     def run_flask(self):
-        self.server = make_server('0.0.0.0', 5000, self.app)
+        # One thread per request: /build_progress/stream holds its request open for the whole database build
+        self.server = make_server('0.0.0.0', 5000, self.app, threaded=True)
         self.server.serve_forever()
 
@@ -0,0 +1,143 @@
+import json
+import threading
+
+
+class LineageIndex:
+    """
+    Precomputed lineages: for every first season (an anime whose prequel is False) the chain of ids
+    reached by following its sequels, in chronological order.
+
+    The chain table is built once and then kept up to date by `update`, which only rebuilds the chains
+    that run through the changed anime, so its cost is proportional to the chain length.
+    `version` is increased whenever any chain changes, clients can cache lineage data against it.
+    """
+
+    def __init__(self, animes):
+        self.animes = animes  # The repository's id -> Anime dict, read only
+        self.chains = {}  # root id -> [ids of the lineage]
+        self.roots_of = {}  # member id -> {root ids of the chains it is part of}
+        self.predecessors = {}  # id -> {ids whose sequel it is}
+        self.sequel_of = {}  # id -> the sequel that is registered in `predecessors`
+        self.version = 0
+        self.lock = threading.RLock()
+        self.cached_json = (None, None)
+
+    def rebuild(self):
+        with self.lock:
+            self.chains, self.roots_of, self.predecessors, self.sequel_of = {}, {}, {}, {}
+            for anime in list(self.animes.values()):
+                self._register_sequel(anime)
+            for anime in list(self.animes.values()):
+                if anime.prequel is False:
+                    self._build_chain(anime.id)
+            self.version += 1
+
+    def update(self, anime_id):
+        """
+        Brings the chains up to date after `anime_id` was added or its prequel/sequel changed.
+        """
+        with self.lock:
+            anime = self.animes.get(anime_id)
+            if anime is not None:
+                self._register_sequel(anime)
+
+            roots = set(self.roots_of.get(anime_id, ())) | self._roots_reaching(anime_id)
+            if anime_id in self.chains:
+                roots.add(anime_id)  # May no longer be a first season
+
+            changed = False
+            for root in roots:
+                changed |= self._build_chain(root)
+            if changed:
+                self.version += 1
+
+    def get_lineages(self):
+        """
+        :return: root id -> lineage, the format of AnimeRepository.generate_anime_seasons_liniage.
+        """
+        with self.lock:
+            return dict(self.chains)
+
+    def get_lineage(self, anime_id):
+        """
+        :return: The first lineage `anime_id` is part of, or an empty list.
+        """
+        with self.lock:
+            roots = self.roots_of.get(anime_id)
+            if not roots:
+                return []
+            return list(self.chains[min(roots)])
+
+    def get_lineages_of(self, anime_ids):
+        """
+        :return: root id -> lineage, for every lineage that contains one of `anime_ids`.
+        """
+        with self.lock:
+            roots = set()
+            for anime_id in anime_ids:
+                roots.update(self.roots_of.get(anime_id, ()))
+            return {root: list(self.chains[root]) for root in roots}
+
+    def get_lineages_json(self):
+        """
+        :return: (version, lineages serialized as JSON), serialized once per version.
+        """
+        with self.lock:
+            version, body = self.cached_json
+            if version != self.version:
+                body = json.dumps(self.chains)
+                self.cached_json = (self.version, body)
+            return self.version, body
+
+    def _register_sequel(self, anime):
+        old_sequel = self.sequel_of.get(anime.id)
+        if old_sequel == anime.sequel:
+            return
+        if old_sequel:
+            self.predecessors.get(old_sequel, set()).discard(anime.id)
+        if anime.sequel:
+            self.predecessors.setdefault(anime.sequel, set()).add(anime.id)
+        self.sequel_of[anime.id] = anime.sequel
+
+    def _roots_reaching(self, anime_id):
+        """
+        Walks back over sequel links and returns every first season whose sequel chain reaches `anime_id`.
+        """
+        roots, seen, stack = set(), set(), [anime_id]
+        while stack:
+            id = stack.pop()
+            if id in seen:
+                continue
+            seen.add(id)
+            anime = self.animes.get(id)
+            if anime is None:
+                continue
+            if anime.prequel is False:
+                roots.add(id)
+            stack.extend(self.predecessors.get(id, ()))
+        return roots
+
+    def _build_chain(self, root):
+        anime = self.animes.get(root)
+        old_chain = self.chains.get(root)
+        new_chain = None
+        if anime is not None and anime.prequel is False:
+            new_chain, seen = [root], {root}
+            while anime.sequel and anime.sequel not in seen:
+                anime = self.animes.get(anime.sequel)
+                if anime is None:
+                    break
+                new_chain.append(anime.id)
+                seen.add(anime.id)
+
+        if new_chain == old_chain:
+            return False
+        for id in old_chain or ():
+            self.roots_of.get(id, set()).discard(root)
+        if new_chain:
+            self.chains[root] = new_chain
+            for id in new_chain:
+                self.roots_of.setdefault(id, set()).add(root)
+        else:
+            self.chains.pop(root, None)
+        return True
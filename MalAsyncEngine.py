@@ -0,0 +1,106 @@
+import asyncio
+import threading
+
+try:
+    import aiohttp
+except ImportError:  # Optional, only needed for Requester(engine='async')
+    aiohttp = None
+
+
+class AsyncResponse:
+    """
+    The parts of an aiohttp response the Requester looks at, read before the connection goes back to the pool.
+    Mirrors the requests.Response attributes used by Requester and RateGovernor.
+    """
+
+    def __init__(self, status_code, headers, data):
+        self.status_code = status_code
+        self.headers = headers
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class AsyncMalEngine:
+    """
+    asyncio implementation of the Requester's network calls (user list pagination and anime details).
+
+    Runs its own event loop on a daemon thread, so the Requester's synchronous interface stays the same:
+    every public method schedules a coroutine on that loop and blocks until it is done.
+    At most `max_concurrency` requests are in flight; all of them still wait on the Requester's RateGovernor.
+    """
+
+    def __init__(self, requester, max_concurrency=8):
+        if aiohttp is None:
+            raise ImportError("Requester(engine='async') needs aiohttp, install it with 'pip install aiohttp'")
+        self.requester = requester
+        self.max_concurrency = max_concurrency
+        self.retry_exceptions = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.session, self.semaphore = self.run(self._create_session())
+
+    async def _create_session(self):
+        # Both have to be created inside the loop they are used in
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.max_concurrency)
+        return aiohttp.ClientSession(connector=connector), asyncio.Semaphore(self.max_concurrency)
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self):
+        self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def fetch_anime_infos(self, anime_ids):
+        return self.run(self._fetch_anime_infos(anime_ids))
+
+    def fetch_user_anime_list(self, pages, params):
+        return self.run(self._fetch_user_anime_list(pages, params))
+
+    async def _fetch_anime_infos(self, anime_ids):
+        return await asyncio.gather(*(self._fetch_anime_info(anime_id) for anime_id in anime_ids))
+
+    async def _fetch_anime_info(self, anime_id):
+        anime_details_url, params = self.requester._anime_info_request(anime_id)
+        try:
+            headers = self.requester.headers
+            response = await self._get(anime_details_url, params, timeout=2.5)
+            if response.status_code == 401 and await self._refresh_tokens(headers):
+                response = await self._get(anime_details_url, params, timeout=2.5)
+            return self.requester._anime_info_from_response(anime_id, anime_details_url, response)
+        except Exception as e:
+            return self.requester._anime_info_failed(anime_id, anime_details_url, e)
+
+    async def _fetch_user_anime_list(self, pages, params):
+        # MAL only hands out the next page's URL with the current page, so pages are fetched one after another
+        while True:
+            try:
+                headers = self.requester.headers
+                step = pages.handle(await self._get(pages.url, params, timeout=3))
+                if step == pages.REFRESH and not await self._refresh_tokens(headers):
+                    pages.refresh_failed()
+            except Exception as e:
+                return e
+            if step == pages.DONE:
+                return pages.animes
+            if step == pages.ABORT:
+                return None
+
+    async def _get(self, url, params, timeout):
+        async def send():
+            self.requester._count_api_call()
+            async with self.session.get(url, headers=self.requester.headers, params=params,
+                                        timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                data = await response.json(content_type=None) if response.status == 200 else None
+                return AsyncResponse(response.status, response.headers, data)
+
+        async with self.semaphore:
+            return await self.requester.rate_governor.request_async(send, retry_exceptions=self.retry_exceptions)
+
+    async def _refresh_tokens(self, stale_headers):
+        # Token refresh is a blocking requests call, keep it off the event loop
+        return await self.loop.run_in_executor(None, self.requester._refresh_tokens, stale_headers)
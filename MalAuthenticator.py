@@ -1,12 +1,11 @@
 import os
 import json
-import requests, base64
+import base64
 from datetime import datetime, timedelta
 
 import os
 import time
 import base64
-import requests
 import webbrowser
 import json
 import threading
@@ -14,6 +13,7 @@ import threading
 from datetime import datetime, timedelta
 from werkzeug.serving import make_server
 from flask import Flask, request as flaskRequest
+from MalSession import get_mal_session
 
 class TokenGenerator:
     def __init__(self):
@@ -96,7 +96,7 @@ class TokenGenerator:
                     'code_verifier': self.code_verifier
                 }
                 headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-                response = requests.post(token_url, data=data, headers=headers)
+                response = get_mal_session().post(token_url, data=data, headers=headers)
                 self.token = response.json()
                 
                 if 'error' not in self.token:
@@ -144,7 +144,7 @@ class TokenLoader:
             'Content-Type': 'application/x-www-form-urlencoded'
         }
 
-        response = requests.post(token_url, data=data, headers=headers)
+        response = get_mal_session().post(token_url, data=data, headers=headers)
         token = response.json()
         self.token = token
 
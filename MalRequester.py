@@ -1,57 +1,337 @@
-import os, time
+import time
 import logging
-import requests
-from AnimeRepository import AnimeRepository
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from MalSession import get_mal_session
+from RateGovernor import RateGovernor, mal_rate_governor
+from AnimeRepository import get_anime_catalog
+from UserAnimeList import UserAnimeList
+from RelationCrawler import RelationCrawler
+from AnimeRefresher import AnimeRefresher
+from MalAsyncEngine import AsyncMalEngine
 
 
 logging.basicConfig(level=logging.DEBUG)
 
-class Requester:
-    def __init__(self, tokens_loader):
+
+class UserListPages:
+    """
+    State of a paginated user anime list fetch, shared by `Requester._fetch_user_anime_list` and the async engine,
+    which only send the requests. `handle` takes the response for `url` and tells the loop what to do next.
+    """
+    NEXT = 'next'  # Request `url` (the next page, or the same one again after an error)
+    REFRESH = 'refresh'  # Unauthorized, refresh the tokens and request `url` again, `refresh_failed` if that fails
+    DONE = 'done'  # `animes` holds the whole list
+    ABORT = 'abort'  # A page failed twice
+
+    def __init__(self, requester, url, username):
+        self.requester = requester
+        self.url = url
+        self.username = username
+        self.animes = []
+        self.retried = False
+
+    def handle(self, response):
+        if response.status_code == 200:
+            data = response.json()
+            self.animes.extend(data.get('data', []))
+            next_url = data.get('paging', {}).get('next')
+            if not next_url:
+                return self.DONE
+            self.url = next_url
+            return self.NEXT
+        if response.status_code == 401:
+            return self.REFRESH
+        self.requester.errors.append({'url': self.url, 'error_code': response.status_code, 'at': f'get_user_anime_list({self.username})'})
+        if self.retried:
+            return self.ABORT  # Don't replace the user list with a partial one
+        self.retried = True
+        return self.NEXT
+
+    def refresh_failed(self):
+        # Tokens could not be refreshed, redirect to login
+        logging.error("Unauthorized access and token refresh failed.")
+        raise Exception("Authentication failed")
+
+
+class MalClient:
+    """
+    The MAL API calls for anime details, with their rate governor, engine and bookkeeping (api calls, errors, requeued IDs).
+
+    Subclasses authorize the calls: they provide `headers` and `_refresh_tokens(stale_headers)`, which refreshes the
+    tokens after a 401 and returns whether the request should be sent again.
+    """
+    ANIME_INFO_FIELDS = 'id,title,main_picture,alternative_titles,start_date,end_date,synopsis,mean,rank,popularity,num_list_users,num_scoring_users,nsfw,created_at,updated_at,media_type,status,genres,num_episodes,start_season,broadcast,source,average_episode_duration,rating,pictures,background,related_anime,related_manga,recommendations,studios,statistics'
+
+    def __init__(self, session=None, rate_governor=None, engine='sync', max_workers=8,
+                 base_url='https://api.myanimelist.net/v2/', anime_repo=None):
         self.num_api_calls = 0
         self.errors = []
-        self.base_url = 'https://api.myanimelist.net/v2/'
-        self.tokens_loader = tokens_loader
+        self.requeue = []  # IDs whose fetch failed with a retryable error, see `take_requeued`
+        self.stats_lock = threading.Lock()
+        self.base_url = base_url
+        self.session = session or get_mal_session()
+        self.rate_governor = rate_governor or mal_rate_governor
+        self.max_workers = max_workers
+        # 'sync' fetches from a thread pool, 'async' from an asyncio event loop running on its own thread
+        self.engine = AsyncMalEngine(self, max_concurrency=max_workers) if engine == 'async' else None
+        # Generic anime data is shared by all users of the process, only the list and its status are per user
+        self.anime_repo = anime_repo or get_anime_catalog()
+
+    def take_requeued(self):
+        """
+        :return: The requeued IDs, the queue is empty afterwards.
+        """
+        with self.stats_lock:
+            failed, self.requeue = self.requeue, []
+        return failed
+
+    def _count_api_call(self):
+        with self.stats_lock:
+            self.num_api_calls += 1
+
+    def _get(self, url, params, timeout):
+        def send():
+            self._count_api_call()
+            return self.session.get(url, headers=self.headers, params=params, timeout=timeout)
+        return self.rate_governor.request(send)
+
+    def get_anime_info_by_id(self, anime_id):
+        if anime_id and anime_id is not None:
+            if self.anime_repo.get_anime_by_id(anime_id) is None:
+                info, stored = self.load_or_fetch_anime_info(anime_id)
+                if info:
+                    self.anime_repo.create_anime(info, persist=not stored)
+
+    def load_or_fetch_anime_info(self, anime_id):
+        """
+        Returns (info, stored): the info dict of an anime from the anime store if it was saved before
+        (stored=True), else from the MAL API. Does not modify the AnimeRepository, so it is safe to call
+        from worker threads.
+        """
+        if self.anime_repo.has_stored_anime(anime_id):
+            return self.anime_repo.load_anime(anime_id), True
+        return self.fetch_anime_info(anime_id), False
+
+    def load_or_fetch_anime_infos(self, anime_ids):
+        """
+        Like load_or_fetch_anime_info for many IDs at once; the ones that are not stored are fetched concurrently.
+        """
+        results = {}
+        missing = []
+        for anime_id in anime_ids:
+            if self.anime_repo.has_stored_anime(anime_id):
+                results[anime_id] = (self.anime_repo.load_anime(anime_id), True)
+            else:
+                missing.append(anime_id)
+        for anime_id, info in zip(missing, self.fetch_anime_infos(missing)):
+            results[anime_id] = (info, False)
+        return [results[anime_id] for anime_id in anime_ids]
+
+    def fetch_anime_infos(self, anime_ids):
+        """
+        Requests the info dicts of many animes concurrently, through the configured engine.
+        Returns them in the order of `anime_ids`, with None for failed requests.
+        """
+        if not anime_ids:
+            return []
+        if self.engine:
+            return self.engine.fetch_anime_infos(anime_ids)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(self.fetch_anime_info, anime_ids))
+
+    def fetch_anime_info(self, anime_id):
+        """
+        Requests the info dict of an anime from the MAL API. Returns None on failure.
+        """
+        anime_details_url, params = self._anime_info_request(anime_id)
+        try:
+            headers = self.headers
+            response = self._get(anime_details_url, params, timeout=2.5)
+            if response.status_code == 401 and self._refresh_tokens(headers):
+                response = self._get(anime_details_url, params, timeout=2.5)
+            return self._anime_info_from_response(anime_id, anime_details_url, response)
+        except Exception as e:
+            return self._anime_info_failed(anime_id, anime_details_url, e)
+
+    def _anime_info_request(self, anime_id):
+        print("Creating Anime:", anime_id)
+        return self.base_url + f'anime/{anime_id}', {'fields': self.ANIME_INFO_FIELDS}
+
+    def _anime_info_from_response(self, anime_id, anime_details_url, response):
+        if response.status_code == 200:
+            return response.json()
+        else:
+            self.errors.append({'url': anime_details_url, 'error_code': response.status_code, 'at': f'get_anime_info_by_id({anime_id})'})
+            if response.status_code in RateGovernor.RETRY_STATUS_CODES:
+                self._requeue(anime_id)
+            return None
+
+    def _anime_info_failed(self, anime_id, anime_details_url, error):
+        self.errors.append({'url': anime_details_url, 'error_code': None, 'at': f'get_anime_info_by_id({anime_id})', 'error': str(error)})
+        self._requeue(anime_id)
+        return None
+
+    def _requeue(self, anime_id):
+        with self.stats_lock:
+            if anime_id not in self.requeue:
+                self.requeue.append(anime_id)
+
+
+class CatalogClient(MalClient):
+    """
+    MAL client of the catalog's AnimeRefresher, which serves all users of the process and so belongs to none of them.
+
+    Its requests are authorized with the tokens of the most recently attached Requester whose tokens still work
+    (`AnimeRepository.get_requester`): once a user's refresh token is revoked or expired, the next user takes over.
+    Its api calls, errors and requeued IDs are its own, they do not show up in any user's stats.
+    """
 
+    def __init__(self, anime_repo, session=None, rate_governor=None, max_workers=8, max_errors=100):
+        super().__init__(session=session, rate_governor=rate_governor, max_workers=max_workers, anime_repo=anime_repo)
+        self.errors = deque(maxlen=max_errors)  # The latest ones, the refresher runs for the lifetime of the process
+
+    @property
+    def headers(self):
+        """
+        The authorization headers of the current requester, None while no user with working tokens is attached.
+        """
+        requester = self.anime_repo.get_requester()
+        return requester.headers if requester else None
+
+    def _refresh_tokens(self, stale_headers):
+        requester = self.anime_repo.get_requester()
+        if requester is None:
+            return False
+        # Requests with the headers of a requester that was replaced meanwhile are retried with the current one's
+        return requester._refresh_tokens(stale_headers)
+
+
+class Requester(MalClient):
+
+    def __init__(self, tokens_loader, session=None, rate_governor=None, warm_start=True, refresh=True,
+                 engine='sync', max_workers=8, base_url='https://api.myanimelist.net/v2/', background=False, anime_repo=None):
+        super().__init__(session=session, rate_governor=rate_governor, engine=engine, max_workers=max_workers,
+                         base_url=base_url, anime_repo=anime_repo)
+        self.relation_level_stats = []
+        self.token_lock = threading.Lock()
+        self.tokens_loader = tokens_loader
         self.headers = self.tokens_loader.get_headers()
-        self.anime_repo = AnimeRepository()
-        self._generate_anime_database()
+        self.tokens_valid = True  # False once the tokens could not be refreshed
+        self.user_list = UserAnimeList(self.anime_repo)
+        # Keeps airing shows up to date without a full re-crawl, started once the database is built.
+        # One refresher serves the whole catalog, it authorizes its calls with the latest user whose tokens work.
+        self.anime_repo.attach_requester(self)
+        self.refresher = self.anime_repo.attach_refresher(
+            AnimeRefresher(CatalogClient(self.anime_repo, session=self.session, rate_governor=self.rate_governor)))
+
+        self.state = 'pending'
+        self.build_done = threading.Event()
+        self.build_thread = None
+        if background:
+            self.start_build(warm_start, refresh)
+        else:
+            self._build(warm_start, refresh)
+
+    def start_build(self, warm_start=True, refresh=True):
+        """
+        Builds the anime database on a daemon thread and returns immediately.
+        The repository fills up while the build runs, `get_progress` reports how far it got.
+        """
+        self.build_thread = threading.Thread(target=self._build, args=(warm_start, refresh), daemon=True)
+        self.build_thread.start()
+
+    def _build(self, warm_start, refresh):
+        try:
+            if warm_start:
+                self.state = 'warm_start'
+                started = time.monotonic()
+                loaded = self.anime_repo.warm_start()
+                logging.info(f'Warm start: {loaded} animes in the catalog after {time.monotonic() - started:.2f}s')
+            self._generate_anime_database()
+            self.state = 'done'
+            if refresh:
+                self.refresher.start()
+        except Exception:
+            self.state = 'failed'
+            raise
+        finally:
+            self.build_done.set()
+
+    def get_progress(self):
+        return {
+            'state': self.state,
+            'done': self.build_done.is_set(),
+            'animes_loaded': len(self.user_list.get_visible_ids()),
+            'user_animes': len(self.user_list.anime_ids or []),
+            'relation_level': len(self.relation_level_stats),
+            'api_calls': self.num_api_calls,
+            'errors': len(self.errors),
+        }
 
     def _generate_all_relation_levels(self):
-        i, new_animes_num = 0, 1
-        while(new_animes_num > 0):
-            new_animes_num = self._generate_next_relations_level(i+1)
-            i+=1
-
-    def _generate_next_relations_level(self,i):
-        logging.debug(f'Generating next relationship level: {i}. ROUND -->')
-        last_animes_num = len(self.anime_repo.get_all_animes())
-        self.anime_repo.get_prequel_sequel()
-
-        for anime in self.anime_repo.get_all_animes():
-            self.get_anime_info_by_id(anime.prequel)
-            self.get_anime_info_by_id(anime.sequel)
-
-        current_animes_num = len(self.anime_repo.get_all_animes())
-        new_animes_num = current_animes_num-last_animes_num
+        # Only the user's animes are crawled from, relations the catalog already knows cost nothing
+        new_animes_num = self._crawl(start_ids=self.user_list.anime_ids)
         logging.debug(f'- New Animes in AnimeRepository: {new_animes_num}')
+
+    def _crawl(self, start_ids=None, fetch_ids=()):
+        crawler = RelationCrawler(self)
+        new_animes_num = crawler.crawl(start_ids, fetch_ids)
+        self.relation_level_stats.extend(crawler.level_stats)
         return new_animes_num
 
+    def _retry_requeued(self, max_rounds=3):
+        for round in range(max_rounds):
+            failed = self.take_requeued()
+            if not failed:
+                return
+            delay = self.rate_governor.backoff_delay(round + 1)
+            logging.info(f'Retrying {len(failed)} animes that failed to load in {delay:.1f}s...')
+            time.sleep(delay)
+            self._crawl(start_ids=[], fetch_ids=failed)
+
+    def _refresh_tokens(self, stale_headers):
+        with self.token_lock:
+            if self.headers != stale_headers:
+                return True  # Another worker already refreshed them
+            if self.tokens_loader.refresh_tokens():
+                self.headers = self.tokens_loader.get_headers()
+                self.tokens_valid = True
+                return True
+            self.tokens_valid = False
+            return False
+
+    def get_stats(self):
+        stats = {
+            'num_api_calls': self.num_api_calls,
+            'num_errors': len(self.errors),
+            'num_requeued': len(self.requeue),
+            'relation_levels': list(self.relation_level_stats),
+            'rate_governor': self.rate_governor.get_stats(),
+            'refresher': self.refresher.get_stats(),
+        }
+        stats.update(self.session.get_stats())
+        return stats
+
     def _generate_anime_database(self):
         # -- MAIN STARTER LOGIC --
-        while self.anime_repo.user_anime_list == None:
+        self.state = 'loading_user_list'
+        attempt = 0
+        while self.user_list.anime_ids is None:
             self.get_user_anime_list()
-            try:
-                for id in self.anime_repo.user_anime_list:
-                    self.get_anime_info_by_id(id)
-            except TypeError as e:
-                print(e)
-                print('API LIMIT HAS BEEN REACHED OR ANOTHER ERROR IS OCCURING, THAT PREVENTS MAL-API COMMUNICATION, TRYING AGAIN IN 1 MINUTE...')
-                time.sleep(60)
+            if self.user_list.anime_ids is None:
+                attempt += 1
+                delay = self.rate_governor.backoff_delay(attempt)
+                logging.warning(f'Could not load the user anime list, trying again in {delay:.1f}s...')
+                time.sleep(delay)
 
         # Get the immediate prequel and sequel id of every anime in AnimeRepository and create a new Anime object from those ids in AnimeRepository
         print('- Animes in AnimeRepository at start:', len(self.anime_repo.get_all_animes()))
+        self.state = 'crawling_relations'
         self._generate_all_relation_levels()
+        self.state = 'retrying_failed'
+        self._retry_requeued()
 
     def get_user_anime_list(self, username='@me', limit=1000, status=None, sort='list_score'):
         base_user_list_url = self.base_url + f'users/{username}/animelist'
@@ -65,69 +345,27 @@ class Requester:
         if sort:
             params['sort'] = sort
 
-        all_anime = []
-        retry = False
+        pages = UserListPages(self, base_user_list_url, username)
+        if self.engine:
+            all_anime = self.engine.fetch_user_anime_list(pages, params)
+        else:
+            all_anime = self._fetch_user_anime_list(pages, params)
+        if not isinstance(all_anime, list):
+            return all_anime
+
+        new_animes = self.user_list.update(all_anime)
+        self._crawl(start_ids=[], fetch_ids=new_animes)
+
+    def _fetch_user_anime_list(self, pages, params):
         while True:
             try:
-                response = requests.get(base_user_list_url, headers=self.headers, params=params, timeout=3)
-                self.num_api_calls += 1
-                if response.status_code == 200:
-                    data = response.json()
-                    all_anime.extend(data.get('data', []))
-                    paging = data.get('paging', {})
-                    next_url = paging.get('next')
-                    if not next_url:
-                        break
-                    base_user_list_url = next_url
-                elif response.status_code == 401:
-                    # Unauthorized, attempt to refresh tokens
-                    if self.tokens_loader.refresh_tokens():
-                        self.headers = self.tokens_loader.get_headers()
-                        continue  # Retry the request with new tokens
-                    else:
-                        # Tokens could not be refreshed, redirect to login
-                        logging.error("Unauthorized access and token refresh failed.")
-                        raise Exception("Authentication failed")
-                else:
-                    self.errors.append({'url': base_user_list_url, 'error_code': response.status_code, 'at': f'get_user_anime_list({username})'})
-                    if not retry:
-                        retry = True
-                    else:
-                        break
+                headers = self.headers
+                step = pages.handle(self._get(pages.url, params, timeout=3))
+                if step == pages.REFRESH and not self._refresh_tokens(headers):
+                    pages.refresh_failed()
             except Exception as e:
                 return e
-
-
-        new_animes = self.anime_repo.update_anime_list_status(all_anime)
-        for new_anime_id in new_animes:
-            self.get_anime_info_by_id(new_anime_id)
-
-        self.anime_repo.save_user_anime_list(all_anime)
-
-    def get_anime_info_by_id(self, anime_id):
-        if anime_id and anime_id is not None:
-            if not os.path.exists(f'animes/{anime_id}.json'):
-                print("Creating Anime:", anime_id)
-                anime_details_url = self.base_url + f'anime/{anime_id}'
-
-                params = {
-                    'fields': 'id,title,main_picture,alternative_titles,start_date,end_date,synopsis,mean,rank,popularity,num_list_users,num_scoring_users,nsfw,created_at,updated_at,media_type,status,genres,num_episodes,start_season,broadcast,source,average_episode_duration,rating,pictures,background,related_anime,related_manga,recommendations,studios,statistics'
-                }
-
-                try:
-                    response = requests.get(anime_details_url, headers=self.headers, params=params, timeout=2.5)
-                    self.num_api_calls += 1
-                    if response.status_code == 200:
-                        info = response.json()
-                        self.anime_repo.create_anime(info)
-                    else:
-                        self.errors.append({'url': anime_details_url, 'error_code': response.status_code, 'at': f'get_anime_info_by_id({anime_id})'})
-                        if len([error for error in self.errors if error['error_code'] == 443]) >= 10:
-                            self.tokens_loader.refresh_tokens()
-                        return None
-                except:
-                    return None
-            else:
-                if self.anime_repo.get_anime_by_id(anime_id) is None:
-                    info = self.anime_repo.load_anime(anime_id)
-                    self.anime_repo.create_anime(info)
+            if step == pages.DONE:
+                return pages.animes
+            if step == pages.ABORT:
+                return None
@@ -0,0 +1,126 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class ConnectionStats:
+    """
+    Counts requests sent through a MalSession and the TCP(+TLS) connections opened to serve them.
+    Every request that did not need a new connection reused a pooled keep-alive one.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def count_connection(self):
+        with self.lock:
+            self.connections_opened += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'connections_opened': self.connections_opened,
+                'connections_reused': max(self.requests - self.connections_opened, 0),
+            }
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connection pools report every new connection to a ConnectionStats.
+    """
+
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        stats = self.stats
+
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                stats.count_connection()
+                return super()._new_conn()
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                stats.count_connection()
+                return super()._new_conn()
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        self.stats.count_request()
+        return super().send(request, **kwargs)
+
+
+class MalSession:
+    """
+    Keep-alive HTTP client shared by every MAL API call (user lists, anime details and token refreshes).
+
+    :param pool_connections: Number of hosts to keep a connection pool for.
+    :param pool_maxsize: Maximum number of open connections per host; further requests wait for a free one.
+    :param retries: How often failed connects and reads are retried on a fresh connection.
+    :param backoff_factor: Retries sleep backoff_factor * 2 ** (retry - 1) seconds.
+
+    Retrying on HTTP status codes (429, 5xx) is left to the RateGovernor, which shares the backoff across all callers.
+    """
+
+    def __init__(self, pool_connections=4, pool_maxsize=8, retries=3, backoff_factor=0.5):
+        self.stats = ConnectionStats()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status=0,
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False,
+        )
+        adapter = CountingHTTPAdapter(
+            self.stats,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=True,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    def get_stats(self):
+        return self.stats.as_dict()
+
+    def close(self):
+        self.session.close()
+
+
+_mal_session = None
+_mal_session_lock = threading.Lock()
+
+
+def get_mal_session():
+    """
+    Returns the process-wide MalSession, creating it on first use.
+    """
+    global _mal_session
+    with _mal_session_lock:
+        if _mal_session is None:
+            _mal_session = MalSession()
+        return _mal_session
@@ -0,0 +1,196 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+import requests
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Refills `rate` tokens per second up to `capacity`.
+
+    Tokens are reserved rather than polled: a caller that finds the bucket empty is told how long
+    to sleep and its token is already spoken for, so waiting threads are served in arrival order.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """
+        Takes `tokens` from the bucket and returns the number of seconds to wait before they are usable.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self, tokens=1):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class RateGovernor:
+    """
+    Every MAL API call goes through RateGovernor.request (or request_async), which
+    - waits for a token from a bucket sized to the MAL rate limit,
+    - on 429 pauses all callers for Retry-After seconds (or a backoff delay if the header is missing),
+    - retries 429, 5xx and connection errors with jittered exponential backoff.
+
+    :param rate: Sustained requests per second.
+    :param burst: Requests that may be sent back to back after an idle period.
+    :param max_retries: Retries per request before the last response (or error) is handed back.
+    :param base_delay: First backoff delay in seconds, doubled on every further retry.
+    :param max_delay: Upper bound for a single backoff or Retry-After pause.
+    """
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+    def __init__(self, rate=2.0, burst=4, max_retries=4, base_delay=1.0, max_delay=60.0):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.lock = threading.Lock()
+        self.paused_until = 0.0
+        self.num_requests = 0
+        self.num_throttled = 0
+        self.num_retries = 0
+        self.seconds_waited = 0.0
+
+    def request(self, send):
+        """
+        Sends a request under the rate limit.
+
+        :param send: Callable that performs exactly one HTTP request and returns its response.
+        :return: The first response that is not retryable, or the last one once retries are used up.
+        :raises requests.RequestException: If the last attempt failed with a connection error.
+        """
+        for attempt in range(self.max_retries + 1):
+            self._sleep(self._turn_delay())
+            try:
+                response = send()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                logging.debug(f'MAL request failed ({e}), retry {attempt + 1}/{self.max_retries}')
+                self._sleep(self.backoff_delay(attempt))
+                continue
+            finally:
+                self._count_request(attempt)
+
+            delay = self._retry_delay(response, attempt)
+            if delay is None:
+                return response
+            self._sleep(delay)
+        return response
+
+    async def request_async(self, send, retry_exceptions=()):
+        """
+        Coroutine version of `request` for the asyncio engine.
+
+        :param send: Coroutine function that performs exactly one HTTP request and returns its response.
+        :param retry_exceptions: Connection error types of the async HTTP client that should be retried.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._sleep_async(self._turn_delay())
+            try:
+                response = await send()
+            except retry_exceptions as e:
+                if attempt == self.max_retries:
+                    raise
+                logging.debug(f'MAL request failed ({e}), retry {attempt + 1}/{self.max_retries}')
+                await self._sleep_async(self.backoff_delay(attempt))
+                continue
+            finally:
+                self._count_request(attempt)
+
+            delay = self._retry_delay(response, attempt)
+            if delay is None:
+                return response
+            await self._sleep_async(delay)
+        return response
+
+    def _retry_delay(self, response, attempt):
+        """
+        Returns None if `response` should be handed back, else the seconds to sleep before the next attempt.
+        """
+        if response.status_code not in self.RETRY_STATUS_CODES or attempt == self.max_retries:
+            return None
+
+        delay = self.retry_after(response)
+        if delay is None:
+            delay = self.backoff_delay(attempt)
+        if response.status_code == 429:
+            # The limit is shared by everyone, so everyone has to back off; the pause is served by _turn_delay
+            with self.lock:
+                self.num_throttled += 1
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            logging.warning(f'MAL rate limit hit, pausing requests for {delay:.1f}s')
+            return 0.0
+        logging.debug(f'MAL returned {response.status_code}, retry {attempt + 1}/{self.max_retries} in {delay:.1f}s')
+        return delay
+
+    def backoff_delay(self, attempt):
+        """
+        Full-jitter exponential backoff: uniform in [0, base_delay * 2 ** attempt], capped at max_delay.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def retry_after(self, response):
+        value = response.headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            return min(self.max_delay, max(0.0, float(value)))
+        except ValueError:
+            return None
+
+    def _turn_delay(self):
+        """
+        Takes a token and returns how long to wait before sending: until the token is available and any 429 pause is over.
+        """
+        with self.lock:
+            pause = self.paused_until - time.monotonic()
+        return max(pause, self.bucket.reserve())
+
+    def _count_request(self, attempt):
+        with self.lock:
+            self.num_requests += 1
+            self.num_retries += attempt > 0
+
+    def _sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+            with self.lock:
+                self.seconds_waited += seconds
+
+    async def _sleep_async(self, seconds):
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+            with self.lock:
+                self.seconds_waited += seconds
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'requests': self.num_requests,
+                'throttled': self.num_throttled,
+                'retries': self.num_retries,
+                'seconds_waited': round(self.seconds_waited, 2),
+            }
+
+
+# Process-wide governor, shared by every Requester so that parallel crawls stay under the MAL limit together
+mal_rate_governor = RateGovernor()
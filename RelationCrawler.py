@@ -0,0 +1,89 @@
+import time
+import logging
+
+
+class RelationCrawler:
+    """
+    Breadth-first crawl of the prequel/sequel graph of an AnimeRepository.
+
+    Keeps a frontier of relation IDs that are neither in the repository nor already requested,
+    reached from the start animes through the relations the repository already holds,
+    and has the Requester fetch a whole frontier at once with its bounded pool of workers (or its async engine).
+    One round per graph level.
+    """
+
+    def __init__(self, requester):
+        self.requester = requester
+        self.anime_repo = requester.anime_repo
+        self.level_stats = []
+
+    def crawl(self, start_ids=None, fetch_ids=()):
+        """
+        Crawls relations starting from `start_ids` (default: every anime in the repository).
+
+        :param fetch_ids: IDs that are not in the repository yet and are fetched in the first round,
+                          together with the relations of `start_ids`.
+        :return: The number of animes added to the repository.
+        """
+        if start_ids is None:
+            start_animes = self.anime_repo.get_all_animes()
+        else:
+            start_animes = [self.anime_repo.get_anime_by_id(id) for id in start_ids]
+            start_animes = [anime for anime in start_animes if anime is not None]
+
+        seen = {anime.id for anime in start_animes}
+        frontier = self._expand(start_animes, seen)
+        for id in fetch_ids:
+            if id not in seen:
+                seen.add(id)
+                known = self.anime_repo.get_anime_by_id(id)
+                frontier.extend(self._expand([known], seen) if known is not None else [id])
+        total_new = 0
+
+        while frontier:
+            level = len(self.level_stats) + 1
+            logging.debug(f'Generating next relationship level: {level}. ROUND -->')
+            calls_before = self.requester.num_api_calls
+            started = time.monotonic()
+
+            new_animes = []
+            with self.anime_repo.batch():
+                for info, stored in self.requester.load_or_fetch_anime_infos(frontier):
+                    if info:
+                        new_animes.append(self.anime_repo.create_anime(info, persist=not stored))
+
+            stats = {
+                'level': level,
+                'requested': len(frontier),
+                'new_animes': len(new_animes),
+                'api_calls': self.requester.num_api_calls - calls_before,
+                'seconds': round(time.monotonic() - started, 2),
+            }
+            self.level_stats.append(stats)
+            logging.debug(f'- Level {level}: {stats}')
+
+            total_new += len(new_animes)
+            frontier = self._expand(new_animes, seen)
+
+        return total_new
+
+    def _expand(self, animes, seen):
+        """
+        :return: The prequel/sequel IDs reachable from `animes` that are not in the repository yet.
+        Relations the repository already holds are followed through, so a chain whose later seasons are missing
+        (after an interrupted crawl or a failed retry) is completed instead of stopping at its first known season.
+        """
+        frontier = []
+        stack = list(animes)
+        while stack:
+            anime = stack.pop()
+            self.anime_repo.set_prequel_sequel(anime)
+            for related_id in (anime.prequel, anime.sequel):
+                if related_id and related_id not in seen:
+                    seen.add(related_id)
+                    known = self.anime_repo.get_anime_by_id(related_id)
+                    if known is not None:
+                        stack.append(known)
+                    else:
+                        frontier.append(related_id)
+        return frontier
@@ -0,0 +1,77 @@
+import json
+import threading
+
+
+class UserAnimeList:
+    """
+    One user's overlay on the shared AnimeRepository: the ids on their MAL list and the list status of each.
+
+    The repository only holds generic anime data, so users with overlapping lists share every Anime object.
+    What a user sees are the animes of their list plus every lineage one of them is part of.
+    `version` is increased whenever the list is replaced.
+    """
+
+    def __init__(self, anime_repo):
+        self.anime_repo = anime_repo
+        self.anime_ids = None  # ids in list order, None until the list was loaded
+        self.list_status = {}  # anime id -> the user's list_status dict
+        self.version = 0
+        self.lock = threading.Lock()
+        self.cached_json = (None, None)
+
+    def update(self, all_anime):
+        """
+        Replaces the list with the entries of a `users/{username}/animelist` response.
+
+        :return: The ids on the list that are not in the repository yet.
+        """
+        anime_ids, list_status = [], {}
+        for entry in all_anime:
+            anime_id = entry.get('node', {}).get('id', None)
+            if anime_id is not None:
+                anime_ids.append(anime_id)
+                list_status[anime_id] = entry.get('list_status', {})
+
+        with self.lock:
+            self.anime_ids = anime_ids
+            self.list_status = list_status
+            self.version += 1
+        return [anime_id for anime_id in anime_ids if self.anime_repo.get_anime_by_id(anime_id) is None]
+
+    def get_lineages(self):
+        """
+        :return: root id -> lineage, for every lineage that contains an anime of the list.
+        """
+        return self.anime_repo.lineage_index.get_lineages_of(self.anime_ids or ())
+
+    def get_lineages_json(self):
+        """
+        :return: (version, lineages serialized as JSON), where version changes with the list and with the lineage index.
+        """
+        version = f'{self.anime_repo.lineage_index.version}-{self.version}'
+        with self.lock:
+            cached_version, body = self.cached_json
+            if cached_version != version:
+                body = json.dumps(self.get_lineages())
+                self.cached_json = (version, body)
+            return version, body
+
+    def get_visible_ids(self):
+        visible = set(self.anime_ids or ())
+        for lineage in self.get_lineages().values():
+            visible.update(lineage)
+        return visible
+
+    def get_animes(self):
+        """
+        :return: id -> anime dict with the user's list status, for every anime the user sees.
+        """
+        animes = {}
+        list_status = self.list_status
+        for anime_id in self.get_visible_ids():
+            anime = self.anime_repo.get_anime_by_id(anime_id)
+            if anime is not None:
+                anime_dict = anime.to_dict()
+                anime_dict['my_list_status'] = list_status.get(anime_id)
+                animes[anime_id] = anime_dict
+        return animes
@@ -0,0 +1,68 @@
+"""
+Compares the memory taken by Anime objects with the previous layout (per-instance __dict__ plus
+per-instance `request_fields`/`fields` copies) against the current class-level fields and __slots__.
+
+Every record gets its own id, mal_url and list status, the remaining field values are shared between
+records, so the numbers show the cost of the object layout rather than of the MAL data itself.
+
+    python benchmarks/anime_memory_benchmark.py
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Anime import Anime
+
+
+class DictAnime:
+    """
+    The Anime layout before __slots__, kept here for comparison.
+    """
+
+    def __init__(self, **kwargs):
+        self.get_fields()
+        kwargs['mal_url'] = f'https://myanimelist.net/anime/{kwargs["id"]}/'
+
+        for field in self.fields:
+            setattr(self, field, kwargs.get(field, None))
+
+    def get_fields(self):
+        self.request_fields = Anime.request_fields
+        self.fields = self.request_fields.split(',')
+        self.fields.append('mal_url')
+
+
+SHARED_INFO = {
+    'title': 'Sousou no Frieren',
+    'main_picture': {'medium': 'https://cdn.myanimelist.net/images/anime/1015/138006.jpg', 'large': 'https://cdn.myanimelist.net/images/anime/1015/138006l.jpg'},
+    'alternative_titles': {'synonyms': ["Frieren at the Funeral"], 'en': "Frieren: Beyond Journey's End", 'ja': '葬送のフリーレン'},
+    'start_date': '2023-09-29', 'end_date': '2024-03-22', 'synopsis': 'x' * 1000,
+    'mean': 9.3, 'rank': 1, 'popularity': 180, 'num_list_users': 1000000, 'num_scoring_users': 600000,
+    'nsfw': 'white', 'media_type': 'tv', 'status': 'finished_airing', 'num_episodes': 28,
+    'genres': [{'id': 2, 'name': 'Adventure'}, {'id': 8, 'name': 'Drama'}],
+    'related_anime': [], 'related_manga': [], 'recommendations': [], 'prequel': False, 'sequel': False,
+}
+
+
+def measure(cls, count):
+    tracemalloc.start()
+    records = [cls(id=i, my_list_status={'status': 'completed', 'score': 8}, **SHARED_INFO) for i in range(count)]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return current
+
+
+def main():
+    for count in (10_000, 100_000):
+        dict_bytes = measure(DictAnime, count)
+        slots_bytes = measure(Anime, count)
+        print(f'{count:>7} records: __dict__ {dict_bytes / 2**20:7.1f} MiB ({dict_bytes / count:5.0f} B/record)'
+              f'   __slots__ {slots_bytes / 2**20:7.1f} MiB ({slots_bytes / count:5.0f} B/record)'
+              f'   saved {1 - slots_bytes / dict_bytes:.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Parses the saved anime pages in benchmarks/fixtures offline, with the lxml parser of the HTTP fast path
+(AnimeScrape.EpisodePageParser) and with the BeautifulSoup extraction the scraper used on the browser's page_source.
+
+The fixtures are synthetic pages with the structure of a shiroko.co anime page: an episode list, the airing date
+element of the next episode (airing page only) and unrelated recommendation links.
+
+    python benchmarks/episode_page_parser_benchmark.py --rounds 50
+"""
+import os
+import sys
+import time
+import argparse
+from urllib.parse import urljoin
+from bs4 import BeautifulSoup as bs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from AnimeScrape.EpisodePageParser import parse_episode_page, AIRING_DATE_CLASS
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PAGES = {
+    # fixture file -> AniList id of the anime on the page
+    'anime_page_airing.html': 171018,
+    'anime_page_finished.html': 21,
+}
+
+
+def parse_with_beautifulsoup(page_html, anime_url, anilist_id):
+    # The extraction AnimeScraper.get_episode_data ran on driver.page_source
+    soup = bs(page_html, 'html.parser')
+    links = []
+    for tag in soup.find_all('a', href=True):
+        full_url = urljoin(anime_url, tag['href'])
+        if str(anilist_id) in full_url and 'watch?id' in full_url:
+            links.append(full_url)
+    date_div = soup.find('div', class_=AIRING_DATE_CLASS)
+    return {'links': list(dict.fromkeys(links)), 'date': date_div.get_text(strip=True) if date_div else None}
+
+
+def measure(parse, page_html, anime_url, anilist_id, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        page = parse(page_html, anime_url, anilist_id)
+    return (time.perf_counter() - started) / rounds, page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=50, help='parses per page and parser')
+    args = parser.parse_args()
+
+    for file_name, anilist_id in PAGES.items():
+        with open(os.path.join(FIXTURES, file_name), 'rb') as file:
+            page_html = file.read()
+        anime_url = f'https://shiroko.co/en/anime/{anilist_id}'
+
+        lxml_seconds, lxml_page = measure(parse_episode_page, page_html, anime_url, anilist_id, args.rounds)
+        bs_seconds, bs_page = measure(parse_with_beautifulsoup, page_html, anime_url, anilist_id, args.rounds)
+        assert lxml_page == bs_page, f'{file_name}: the parsers disagree'
+
+        print(f'{file_name} ({len(page_html) / 1024:.0f} KiB, {len(lxml_page["links"])} episode links, date: {lxml_page["date"]})')
+        print(f'    lxml:          {lxml_seconds * 1000:7.2f} ms/page')
+        print(f'    BeautifulSoup: {bs_seconds * 1000:7.2f} ms/page   ({bs_seconds / lxml_seconds:.1f}x slower)')
+
+
+if __name__ == '__main__':
+    main()
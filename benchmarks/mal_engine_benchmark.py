@@ -0,0 +1,130 @@
+"""
+Compares the wall-clock time of a cold Requester crawl with the sync (thread pool) and the async (aiohttp) engine.
+
+Both engines crawl the same fake MAL API, served from localhost with an artificial per-request latency:
+a user list of `--animes` entries, each the first season of a `--depth` long prequel/sequel chain.
+The rate governor is opened up so that the engines, not the MAL rate limit, are measured; against the real
+API both are capped by the governor's request rate.
+
+    python benchmarks/mal_engine_benchmark.py --animes 200 --depth 3 --latency 0.05
+"""
+import io
+import os
+import sys
+import json
+import time
+import logging
+import contextlib
+import shutil
+import argparse
+import tempfile
+import threading
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from MalSession import MalSession
+from MalRequester import Requester
+from RateGovernor import RateGovernor
+from AnimeRepository import AnimeRepository
+
+
+class FakeMalHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+    animes = 200
+    depth = 3
+    latency = 0.05
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        path = urlparse(self.path).path
+        if path.endswith('/animelist'):
+            body = {'data': [{'node': {'id': self._id(i, 0)}, 'list_status': {'status': 'completed'}} for i in range(self.animes)], 'paging': {}}
+        else:
+            body = self._anime(int(path.rstrip('/').rsplit('/', 1)[1]))
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _id(self, series, season):
+        return series * 100 + season + 1
+
+    def _anime(self, anime_id):
+        series, season = divmod(anime_id - 1, 100)
+        related = []
+        if season > 0:
+            related.append({'node': {'id': self._id(series, season - 1)}, 'relation_type': 'prequel'})
+        if season < self.depth - 1:
+            related.append({'node': {'id': self._id(series, season + 1)}, 'relation_type': 'sequel'})
+        return {'id': anime_id, 'title': f'Series {series} Season {season + 1}', 'status': 'finished_airing', 'related_anime': related}
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTokensLoader:
+    def get_headers(self):
+        return {'Authorization': 'Bearer benchmark'}
+
+    def refresh_tokens(self):
+        return True
+
+
+def run_crawl(engine, base_url, workers):
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(workdir)  # fresh, empty anime store per run
+    try:
+        started = time.monotonic()
+        with contextlib.redirect_stdout(io.StringIO()):
+            requester = Requester(
+                FakeTokensLoader(),
+                session=MalSession(pool_maxsize=workers),
+                rate_governor=RateGovernor(rate=10_000, burst=10_000),
+                warm_start=False,
+                refresh=False,
+                engine=engine,
+                max_workers=workers,
+                base_url=base_url,
+                anime_repo=AnimeRepository(),  # not the shared catalog, every run starts cold
+            )
+        elapsed = time.monotonic() - started
+        if requester.engine:
+            requester.engine.close()
+        return elapsed, len(requester.anime_repo.animes), requester.num_api_calls
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--animes', type=int, default=200, help='entries in the fake user list')
+    parser.add_argument('--depth', type=int, default=3, help='seasons per series')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the fake server waits per request')
+    parser.add_argument('--workers', type=int, default=8, help='thread pool size / async concurrency')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    FakeMalHandler.animes, FakeMalHandler.depth, FakeMalHandler.latency = args.animes, args.depth, args.latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeMalHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/v2/'
+
+    for engine in ('sync', 'async'):
+        try:
+            elapsed, animes, calls = run_crawl(engine, base_url, args.workers)
+        except ImportError as e:
+            print(f'{engine:>5}: skipped ({e})')
+            continue
+        print(f'{engine:>5}: {elapsed:6.2f}s  {animes} animes  {calls} API calls  {calls / elapsed:7.1f} calls/s')
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
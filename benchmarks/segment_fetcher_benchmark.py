@@ -0,0 +1,106 @@
+"""
+Compares the wall-clock time of downloading an episode's segments one at a time (workers=1, like the old
+VideoDownloader._download_chunks) and with the concurrent SegmentFetcher.
+
+The segments are served from localhost with an artificial per-request latency, which stands in for the CDN round trip.
+Every `--fail-every`th request fails once with a 503, so the retries are exercised too.
+
+    python benchmarks/segment_fetcher_benchmark.py --segments 300 --size 512 --latency 0.05 --workers 8
+"""
+import os
+import sys
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from AnimeScrape.SegmentFetcher import SegmentFetcher
+
+
+class FakeCdnHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    size = 512 * 1024
+    latency = 0.05
+    fail_every = 50
+    requests_served = 0
+    failed = set()
+    lock = threading.Lock()
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        index = int(self.path.rsplit('/', 1)[1].split('.')[0])
+        with self.lock:
+            FakeCdnHandler.requests_served += 1
+            fail = self.fail_every and index % self.fail_every == 0 and index not in self.failed
+            if fail:
+                self.failed.add(index)
+        if fail:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = segment_data(index, self.size)
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp2t')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def segment_data(index, size):
+    return (index.to_bytes(4, 'big') * (size // 4 + 1))[:size]
+
+
+def run_download(base_url, segments, workers):
+    FakeCdnHandler.failed = set()
+    workdir = tempfile.mkdtemp()
+    try:
+        session = requests.Session()
+        session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=max(10, workers)))
+        fetcher = SegmentFetcher(session, workers=workers, backoff=0.05)
+        output_path = os.path.join(workdir, 'episode.ts')
+        stats = fetcher.fetch([f'{base_url}{i}.ts' for i in range(segments)], output_path)
+
+        expected = hashlib.sha256(b''.join(segment_data(i, FakeCdnHandler.size) for i in range(segments))).hexdigest()
+        with open(output_path, 'rb') as file:
+            assert hashlib.sha256(file.read()).hexdigest() == expected, 'segments were written out of order'
+        return stats
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--segments', type=int, default=300, help='segments in the episode')
+    parser.add_argument('--size', type=int, default=512, help='KiB per segment')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the fake CDN waits per request')
+    parser.add_argument('--workers', type=int, default=8, help='SegmentFetcher workers')
+    parser.add_argument('--fail-every', type=int, default=50, help='every nth segment fails once, 0 to disable')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    FakeCdnHandler.size, FakeCdnHandler.latency, FakeCdnHandler.fail_every = args.size * 1024, args.latency, args.fail_every
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeCdnHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/segments/'
+
+    for workers in (1, args.workers):
+        stats = run_download(base_url, args.segments, workers)
+        print(f'workers={workers:<3} {stats["seconds"]:6.2f}s  {stats["mb_per_second"]:7.2f} MB/s  '
+              f'{stats["segments_per_second"]:7.1f} segments/s  {stats["retries"]} retries')
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
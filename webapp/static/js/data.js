@@ -10,6 +10,30 @@ export async function refreshUserData() {
     await fetch('/refresh_user_list_status');
 }
 
+/**
+ * Clears the cached anime and lineage data, so the next fetch gets the latest state from the backend.
+ */
+export function clearCachedData() {
+    cachedAnimeData = null;
+    cachedLineageData = null;
+}
+
+/**
+ * Subscribes to the progress of the background database build.
+ * @param {function(object): void} onProgress - Called with every progress update from the backend.
+ * @returns {EventSource} - The event source, closed automatically once the build is done.
+ */
+export function watchBuildProgress(onProgress) {
+    const source = new EventSource('/build_progress/stream');
+    source.onmessage = (event) => {
+        const progress = JSON.parse(event.data);
+        onProgress(progress);
+        if (progress.done) source.close();
+    };
+    source.onerror = () => source.close();
+    return source;
+}
+
 /**
  * Fetches lineage data from the backend.
  * @returns {Promise<object>} - The lineage data.
@@ -1,5 +1,5 @@
 // main.js
-import { fetchLineageData, fetchAnimes, cachedLineageData, refreshUserData } from './data.js';
+import { fetchLineageData, fetchAnimes, cachedLineageData, cachedAnimeData, refreshUserData, clearCachedData, watchBuildProgress } from './data.js';
 import { parseAnimeData } from './parser.js';
 import { addEventListeners, markUnavailableEpisodes } from './events.js';
 import { playAnime, clearAllLastWatchedEpisodes } from './player.js';
@@ -11,9 +11,39 @@ window.addEventListener('DOMContentLoaded', async () => {
     applyInitialFilters();        
     await loadAllEpisodeData();
     addEventListeners();
+    renderedAnimeCount = Object.keys(cachedAnimeData).length;
+    watchBuildProgress(onBuildProgress);
     await resumeLastWatchedEpisode();
 });
 
+const BUILD_RENDER_INTERVAL = 3000; // Re-render at most every 3 seconds while the database is being built
+let renderedAnimeCount = 0;
+let lastBuildRender = 0;
+
+/**
+ * Shows the progress of the background database build and re-renders the animes loaded so far.
+ * @param {object} progress - The progress reported by the backend.
+ */
+async function onBuildProgress(progress) {
+    const progressElement = document.getElementById('build-progress');
+    if (progress.done) {
+        progressElement.style.display = 'none';
+    } else {
+        progressElement.style.display = '';
+        progressElement.textContent = `Loading your list (${progress.state.replace(/_/g, ' ')}): ${progress.animes_loaded} animes, relation level ${progress.relation_level}, ${progress.api_calls} API calls, ${progress.errors} errors`;
+    }
+
+    const now = Date.now();
+    if (progress.animes_loaded === renderedAnimeCount) return;
+    if (!progress.done && now - lastBuildRender < BUILD_RENDER_INTERVAL) return;
+
+    renderedAnimeCount = progress.animes_loaded;
+    lastBuildRender = now;
+    clearCachedData();
+    await Promise.all([fetchLineageData(), fetchAnimes()]);
+    applyInitialFilters();
+}
+
 function applyInitialFilters() {
     const selectedWatchStatuses = getSelectedValues('watch_status');
     const selectedAiringStatuses = getSelectedValues('airing_status');
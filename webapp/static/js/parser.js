@@ -15,6 +15,7 @@ export function parseAnimeData(lineageData, selectedWatchStatuses, selectedAirin
 
         lineage.forEach((animeId) => {
             const animeObj = cachedAnimeData[animeId];
+            if (!animeObj) return; // Not loaded yet while the database is still being built
 
             const watchStatus = getWatchStatus(animeObj);
             const airingStatus = getAiringStatus(animeObj);